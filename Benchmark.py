@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+from jModules.Colors     import colors,printer
+from jModules.CV         import CV
+from contextlib          import redirect_stdout
+
+import cv2
+import glob
+import json
+import numpy as np
+import os
+import sys
+import time
+import tracemalloc
+
+#Usage:
+# Replays recorded frames (Screenshooter's tmp/screenshot.*.png|npy) through CV so changes can be profiled offline.
+#   from jModules.Benchmark import Benchmark
+#   benchmark = Benchmark(frames='tmp')            # Or frames=None for synthetic frames
+#   results   = benchmark.run()
+#   benchmark.report(results, benchmark.compare(results, 'baseline.json'))
+#
+# Or from a shell:
+#   python -m jModules.Benchmark [framesDirectory] [--baseline baseline.json] [--save-baseline]
+
+class Benchmark():
+    def __init__(self, frames=None, cv=None, repeat=1, debug=False):
+        """
+        frames,     A directory of recorded frames, a list of images, or None for synthetic frames.
+        cv,         The CV object to benchmark, by default a new one without an OCR cache so repeat
+                    passes time tesseract rather than cache hits.
+        repeat,     How many times to replay every frame per call.
+        """
+        self.debug  = debug
+        self.cv     = cv or CV(ocrCacheSize=0)
+        self.repeat = repeat
+
+        match frames:
+            case None:
+                self.frames = self.syntheticFrames()
+            case str():
+                self.frames = self.loadFrames(frames)
+            case _:
+                self.frames = [self.cv.prepImage(frame) for frame in frames]
+
+        if not self.frames:
+            printer('No frames to benchmark with.')
+            exit(1)
+
+        # A needle which is known to be in the first frame
+        height, width = self.frames[0].shape[:2]
+        self.needle   = self.frames[0][height//4:height//4+32, width//4:width//4+48].copy()
+
+    def loadFrames(self, directory):
+        """Decodes every recorded frame in a directory up front so decoding isn't part of the timings."""
+        frames = []
+        for path in sorted(glob.glob(os.path.join(directory, 'screenshot.*'))):
+            if path.endswith('.npy'):
+                frames.append(np.load(path))
+            else:
+                frame = cv2.imread(path)
+                if frame is not None:
+                    frames.append(frame)
+
+        if self.debug: printer('Loaded %d frames from %s' % (len(frames), directory))
+        return(frames)
+
+    def syntheticFrames(self, count=20, width=1280, height=720, seed=0):
+        """Generates frames with noise, filled boxes, text and an icon which wanders between frames. No display needed."""
+        rng        = np.random.default_rng(seed)
+        background = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (9, 9), 0)
+        icon       = rng.integers(0, 255, (32, 48, 3), dtype=np.uint8)
+        frames     = []
+
+        for index in range(count):
+            frame = background.copy()
+            cv2.rectangle(frame, (width//10, height//2), (width//10 + 40, height//2 + 120), (0, 0, 255), -1)
+            cv2.rectangle(frame, (width//2, height//10), (width//2 + 160, height//10 + 30), (255, 255, 255), -1)
+            cv2.putText(frame, 'Frame %d' % index, (width//2 + 5, height//10 + 22), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+
+            x = width//4 + (index % 5) * 4
+            y = height//4
+            frame[y:y+32, x:x+48] = icon
+            frames.append(frame)
+
+        return(frames)
+
+    def getCalls(self):
+        """The CV calls benchmarked by default, each taking (frame, previousFrame)."""
+        return({
+            'searchImageInImage':     lambda frame, previous: self.cv.searchImageInImage(self.needle, frame),
+            'findBoxOfColorFilling':  lambda frame, previous: self.cv.findBoxOfColorFilling(frame, 20, 20, [0, 200, 200], [10, 255, 255], multiple=True),
+            'getTextWithCoordinates': lambda frame, previous: self.cv.getTextWithCoordinates(frame),
+            'compareImages':          lambda frame, previous: self.cv.compareImages(frame, previous),
+        })
+
+    def measure(self, call):
+        """Times one call over every frame. Returns its stats, or None if the call can't run here."""
+        latencies = []
+
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            try:
+                started = time.perf_counter()
+                for _ in range(self.repeat):
+                    previous = self.frames[-1]
+                    for frame in self.frames:
+                        callStarted = time.perf_counter()
+                        call(frame, previous)
+                        latencies.append(time.perf_counter() - callStarted)
+                        previous = frame
+                elapsed = time.perf_counter() - started
+
+                # Separate pass for memory, tracemalloc slows everything down.
+                # Only covers Python and NumPy allocations, not OpenCV's own.
+                tracemalloc.start()
+                previous = self.frames[-1]
+                for frame in self.frames:
+                    call(frame, previous)
+                    previous = frame
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+            except Exception as e:
+                if tracemalloc.is_tracing():
+                    tracemalloc.stop()
+                print('Skipped: %s' % str(e), file=sys.stderr)
+                return(None)
+
+        latencies = np.array(latencies) * 1000
+        return({
+            'calls':      len(latencies),
+            'mean':       float(latencies.mean()),
+            'p50':        float(np.percentile(latencies, 50)),
+            'p90':        float(np.percentile(latencies, 90)),
+            'p99':        float(np.percentile(latencies, 99)),
+            'max':        float(latencies.max()),
+            'throughput': len(latencies) / elapsed,
+            'peakMemory': peak,
+        })
+
+    def run(self, calls=None):
+        """Benchmarks a dict of name: call(frame, previousFrame), by default getCalls(). Returns name: stats."""
+        results = {}
+        for name, call in (calls or self.getCalls()).items():
+            if self.debug: printer('Benchmarking %s' % name)
+            stats = self.measure(call)
+            if stats:
+                results[name] = stats
+
+        return(results)
+
+    def saveBaseline(self, results, path):
+        """Stores results to compare future runs against."""
+        with open(path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    def compare(self, results, baseline, tolerance=0.2):
+        """
+        Returns a list of (name, metric, baseline, now) where a call got slower or hungrier than
+        the baseline (a saved results file or dict) by more than tolerance (0.2 = 20%).
+        p90 and p99 only count once at least 10 calls on both sides fall past them, below that
+        they're the slowest one or two calls and differ run to run on noise alone.
+        """
+        if isinstance(baseline, str):
+            if not os.path.isfile(baseline):
+                return([])
+            with open(baseline, 'r') as file:
+                baseline = json.load(file)
+
+        regressions = []
+        for name, stats in results.items():
+            if name not in baseline:
+                continue
+
+            calls   = min(stats['calls'], baseline[name]['calls'])
+            metrics = ['p50', 'mean', 'peakMemory']
+            metrics += [metric for metric, percentile in (('p90', 90), ('p99', 99)) if calls * (100 - percentile) / 100 >= 10]
+
+            for metric in metrics:
+                if stats[metric] > baseline[name][metric] * (1 + tolerance):
+                    regressions.append((name, metric, baseline[name][metric], stats[metric]))
+
+            if stats['throughput'] < baseline[name]['throughput'] * (1 - tolerance):
+                regressions.append((name, 'throughput', baseline[name]['throughput'], stats['throughput']))
+
+        return(regressions)
+
+    def report(self, results, regressions=None):
+        """Prints a table of results followed by any regressions."""
+        printer('%s %s %s %s %s %s' % ('call'.ljust(24), 'p50 ms'.rjust(9), 'p90 ms'.rjust(9), 'p99 ms'.rjust(9), 'calls/s'.rjust(9), 'peak KiB'.rjust(10)))
+        for name, stats in results.items():
+            printer('%s %9.2f %9.2f %9.2f %9.1f %10.1f' % (name.ljust(24), stats['p50'], stats['p90'], stats['p99'], stats['throughput'], stats['peakMemory'] / 1024))
+
+        for name, metric, before, now in regressions or []:
+            printer('%%red%%[Regression]%%none%% %s %s: %.2f -> %.2f' % (name, metric, before, now))
+
+        if regressions is not None and not regressions:
+            printer('%green%No regressions against the baseline.%none%')
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay frames through CV and report latency, throughput and peak memory.')
+    parser.add_argument('frames', nargs='?', default=None, help='Directory of recorded screenshot.* frames, synthetic frames if omitted.')
+    parser.add_argument('--baseline', default='benchmark.baseline.json', help='Results file to compare against.')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline.')
+    parser.add_argument('--repeat', type=int, default=1, help='Replay every frame this many times per call.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown before reporting a regression.')
+    args = parser.parse_args()
+
+    benchmark   = Benchmark(frames=args.frames, repeat=args.repeat)
+    results     = benchmark.run()
+    regressions = benchmark.compare(results, args.baseline, tolerance=args.tolerance)
+    benchmark.report(results, regressions if os.path.isfile(args.baseline) else None)
+
+    if args.save_baseline:
+        benchmark.saveBaseline(results, args.baseline)
+        printer('Saved baseline to %s' % args.baseline)
+
+    exit(1 if regressions else 0)
@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 from jModules.Colors     import colors,printer
+from collections         import OrderedDict
+from concurrent.futures  import ThreadPoolExecutor
+from multiprocessing     import shared_memory
 from random              import randint
 from time                import sleep
 
 import colorsys
 import cv2
+import hashlib
 import numpy as np
 import os
 import pytesseract
@@ -13,6 +17,7 @@ import re
 import signal
 import string 
 import subprocess
+import threading
 import time
 
 _scriptRoot = os.path.dirname(os.path.realpath(__file__))
@@ -20,12 +25,62 @@ _scriptName = _scriptRoot.split('/')[-1]
 _namespace  = _scriptName
 
 class CV():
-    def __init__(self, debug=False, loglevel=0, defaultMode='color', defaultThreshold=0.501):
+    def __init__(self, debug=False, loglevel=0, defaultMode='color', defaultThreshold=0.501, defaultMultipleThreshold=0.05, needleCacheSize=64*1024*1024, pyramidLevels=2, ocrCacheSize=1024, ocrCacheDir=None, ocrBackend='pytesseract'):
         self.debug              = debug
         self.loglevel           = loglevel
         self.defaultMode        = defaultMode
         self.defaultThreshold   = defaultThreshold
 
+        # multiple=True keeps everything under the threshold rather than only the best score,
+        # so it needs a far stricter default or textured frames turn up hundreds of matches.
+        self.defaultMultipleThreshold = defaultMultipleThreshold
+
+        # Decoded needle templates keyed by path, evicted least recently used first
+        # once their combined size passes needleCacheSize bytes. 0 disables the cache.
+        self.needleCache        = OrderedDict()
+        self.needleCacheSize    = needleCacheSize
+        self.needleCacheBytes   = 0
+        self.needleCacheLock    = threading.Lock()
+
+        # mode='pyramid' tunables. How many times to halve, the smallest a needle may be
+        # halved down to and how many coarse candidates get refined at full resolution.
+        self.pyramidLevels      = pyramidLevels
+        self.pyramidMinSize     = 8
+        self.pyramidCandidates  = 5
+
+        # getText results keyed by a hash of the crop, lang and config. ocrCacheSize entries
+        # are kept in memory (0 disables the cache) and ocrCacheDir optionally persists them.
+        self.ocrCache           = OrderedDict()
+        self.ocrCacheSize       = ocrCacheSize
+        self.ocrCacheDir        = ocrCacheDir
+        self.ocrCacheLock       = threading.Lock()
+
+        if self.ocrCacheDir:
+            os.makedirs(self.ocrCacheDir, exist_ok=True)
+
+        # 'pytesseract' runs the tesseract binary per call. 'tesserocr' keeps libtesseract engines
+        # loaded for the life of this object, checked out per call and fed raw pixels.
+        self.ocrBackend         = ocrBackend
+        self.ocrEngines         = {} # (lang, -c variables): idle engines
+        self.ocrEnginesLock     = threading.Lock()
+
+        match self.ocrBackend:
+            case 'pytesseract':
+                pass
+            case 'tesserocr':
+                try:
+                    import tesserocr
+                    self.tesserocr = tesserocr
+                except Exception as e:
+                    printer('Failed to load the tesserocr OCR backend: %s' % str(e))
+                    exit(1)
+            case _:
+                printer('Unknown OCR backend: %s' % self.ocrBackend)
+                exit(1)
+
+        # Last known (x, y, w, h) of each needle searched for with trackImageInImage
+        self.trackedNeedles     = {}
+
         if self.debug:
             print('Debugging enabled. Loglevel set to 7')
             self.loglevel = 7
@@ -40,20 +95,54 @@ class CV():
 
         return(list(hsv))
 
-    def prepImage(self, image):
-        """Takes a file path, bytes or an np.ndarray and returns a cv2 object via imread"""
+    def getFrame(self, image, shape=None):
+        """Wraps a screenshot in a Frame so every CV call on it this tick shares one decode and its conversions."""
+        if isinstance(image, Frame):
+            return(image)
+
+        return(Frame(image, cv=self, shape=shape))
+
+    def getGray(self, image):
+        """Grayscale version of any image CV accepts, remembered when given a Frame."""
+        if isinstance(image, Frame):
+            return(image.getGray())
+
+        image = self.prepImage(image)
+        return(self.convertImage(image, 'gray') if image.ndim == 3 else image)
+
+    def getHSV(self, image):
+        """HSV version of any image CV accepts, remembered when given a Frame."""
+        if isinstance(image, Frame):
+            return(image.getHSV())
+
+        return(cv2.cvtColor(self.prepImage(image), cv2.COLOR_BGR2HSV))
+
+    def prepImage(self, image, shape=None):
+        """Takes a file path, an encoded buffer, an np.ndarray or a Frame and returns a cv2 object via imread"""
+        """Buffers are anything supporting the buffer protocol (bytes, bytearray, memoryview, mmap, SharedMemory) and are read without copying."""
+        """Passing shape=(height, width, channels) treats the buffer as already decoded uint8 pixels and returns a view onto it."""
         try:
-            if isinstance(image, str):
+            if isinstance(image, Frame):
+                image   = image.getImage()
+            elif isinstance(image, str):
                 # Load the image
                 image   = cv2.imread(image)
             elif isinstance(image, np.ndarray):
                 image   = image
-            elif isinstance(image, bytes):
-                image   = np.asarray(bytearray(image), dtype="uint8")
-                image   = cv2.imdecode(image, cv2.IMREAD_COLOR) # BGR
             else:
-                printer('Unknown image format: %s' % type(image))
-                exit()
+                if isinstance(image, shared_memory.SharedMemory):
+                    image = image.buf
+
+                try:
+                    buffer  = np.frombuffer(image, dtype=np.uint8)
+                except TypeError:
+                    printer('Unknown image format: %s' % type(image))
+                    exit()
+
+                if shape:
+                    image   = buffer[:int(np.prod(shape))].reshape(shape)
+                else:
+                    image   = cv2.imdecode(buffer, cv2.IMREAD_COLOR) # BGR
 
         except Exception as e:
             printer('Failed to prepare an image: %s' % str(e))
@@ -61,38 +150,204 @@ class CV():
 
         return(image)
 
-    def compareImages(self, image1, image2):
+    def compareImages(self, image1, image2, metric='mse'):
         """Compare two images for a similarity percentage in grayscale"""
+        """metric can be 'mse', 'ssim' or 'histogram' for a percentage, or 'psnr' for decibels (inf when identical)."""
+
+        # Load the two images and convert them to grayscale
+        gray_image1 = self.getGray(image1)
+        gray_image2 = self.getGray(image2)
+
+        if gray_image1.shape != gray_image2.shape and metric != 'histogram':
+            printer('Cannot compare images of different sizes: %s and %s' % (gray_image1.shape, gray_image2.shape))
+            return(False)
+
+        # Identical frames are the common case when watching for changes, skip the maths.
+        if gray_image1.shape == gray_image2.shape and cv2.norm(gray_image1, gray_image2, cv2.NORM_INF) == 0:
+            return(float('inf') if metric == 'psnr' else 100.0)
 
-        # Load the two images
+        match metric:
+            case 'mse':
+                # Sum of squared differences computed by OpenCV without uint8 wraparound or temporaries
+                mse = cv2.norm(gray_image1, gray_image2, cv2.NORM_L2SQR) / gray_image1.size
+
+                # use the MSE to gauge a percentage of similarity
+                similarityPercentage = 100 - (mse / 255.0**2) * 100
+
+            case 'psnr':
+                return(cv2.PSNR(gray_image1, gray_image2))
+
+            case 'ssim':
+                similarityPercentage = self.getSSIM(gray_image1, gray_image2) * 100
+
+            case 'histogram':
+                hist1 = cv2.calcHist([gray_image1], [0], None, [256], [0, 256])
+                hist2 = cv2.calcHist([gray_image2], [0], None, [256], [0, 256])
+                similarityPercentage = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL) * 100
+
+            case _:
+                printer('Unknown comparison metric: %s' % metric)
+                return(False)
+
+        return(similarityPercentage)
+
+    def areImagesIdentical(self, image1, image2):
+        """Cheap check for whether two images have exactly the same pixels."""
         image1 = self.prepImage(image1)
         image2 = self.prepImage(image2)
+        return(image1.shape == image2.shape and cv2.norm(image1, image2, cv2.NORM_INF) == 0)
 
-        # Convert the images to grayscale
-        gray_image1 = self.convertImage(image1, 'gray')
-        gray_image2 = self.convertImage(image2, 'gray')
+    def getSSIM(self, gray_image1, gray_image2):
+        """Mean structural similarity (Wang et al.) of two same sized grayscale images using an 11x11 gaussian window."""
+        C1 = (0.01 * 255) ** 2
+        C2 = (0.03 * 255) ** 2
 
-        # Compute Mean Squared Error (MSE) between them
-        mse = ((gray_image1 - gray_image2) ** 2).mean()
+        image1 = gray_image1.astype(np.float32)
+        image2 = gray_image2.astype(np.float32)
 
-        # use the MSE to gauge a percentage of similarity
-        similarityPercentage = 100 - (mse / 255.0) * 100
-        return(similarityPercentage)
+        mu1 = cv2.GaussianBlur(image1, (11, 11), 1.5)
+        mu2 = cv2.GaussianBlur(image2, (11, 11), 1.5)
+
+        mu1_sq  = mu1 * mu1
+        mu2_sq  = mu2 * mu2
+        mu1_mu2 = mu1 * mu2
+
+        sigma1_sq = cv2.GaussianBlur(image1 * image1, (11, 11), 1.5) - mu1_sq
+        sigma2_sq = cv2.GaussianBlur(image2 * image2, (11, 11), 1.5) - mu2_sq
+        sigma12   = cv2.GaussianBlur(image1 * image2, (11, 11), 1.5) - mu1_mu2
+
+        ssimMap = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
+        return(float(cv2.mean(ssimMap)[0]))
 
     def getText(self, image, lang=None, mode=None, config=None, binaryMin=200, binaryMax=255):
         """Like getTextLocation but simply gets text from an image after processing."""
 
-        image = self.prepImage(image)
-
         if mode:
-            image = self.convertImage(image, mode, binaryMin=binaryMin, binaryMax=binaryMax)
+            image = self.convertImage(image if isinstance(image, Frame) else self.prepImage(image), mode, binaryMin=binaryMin, binaryMax=binaryMax)
+        else:
+            image = self.prepImage(image)
+
+        if self.ocrCacheSize or self.ocrCacheDir:
+            key  = self.getOCRCacheKey(image, lang, config)
+            text = self.getOCRCache(key)
+            if text is None:
+                text = self.recognizeText(image, lang=lang, config=config)
+                self.setOCRCache(key, text)
+        else:
+            text = self.recognizeText(image, lang=lang, config=config)
 
-        text = pytesseract.image_to_string(image, lang=lang, config=config)
         if text:
             return(text)
         else:
             return(False)
 
+    def recognizeText(self, image, lang=None, config=None):
+        """Runs already prepared image data through the configured OCR backend."""
+        match self.ocrBackend:
+            case 'tesserocr':
+                return(self.recognizeTextTesserocr(image, lang=lang, config=config))
+            case _:
+                return(pytesseract.image_to_string(image, lang=lang, config=config))
+
+    def getOCREngine(self, key):
+        """
+        Checks out an idle tesserocr engine for a (lang, variables) key, loading a new one only when they're all busy.
+        Engines are never shared with another set of -c variables, so one call's settings can't leak into the next.
+        """
+        with self.ocrEnginesLock:
+            idle = self.ocrEngines.setdefault(key, [])
+            if idle:
+                return(idle.pop())
+
+        lang, variables = key
+        if self.debug: printer('Loading tesserocr engine for %s %s' % (lang, variables))
+        engine = self.tesserocr.PyTessBaseAPI(lang=lang)
+        for variable, value in variables:
+            engine.SetVariable(variable, value)
+
+        return(engine)
+
+    def releaseOCREngine(self, key, engine):
+        """Returns an engine from getOCREngine() for the next call to use."""
+        with self.ocrEnginesLock:
+            self.ocrEngines[key].append(engine)
+
+    def recognizeTextTesserocr(self, image, lang=None, config=None):
+        """Hands raw pixels straight to libtesseract. Understands --psm N and -c var=value from config."""
+        pageSegMode = self.tesserocr.PSM.AUTO
+        variables   = []
+
+        if config:
+            arguments = config.split()
+            for index, argument in enumerate(arguments[:-1]):
+                match argument:
+                    case '--psm':
+                        pageSegMode = int(arguments[index+1])
+                    case '-c':
+                        variable, _, value = arguments[index+1].partition('=')
+                        variables.append((variable, value))
+
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        bytesPerPixel = 1 if image.ndim == 2 else image.shape[2]
+
+        key    = (lang or 'eng', tuple(sorted(variables)))
+        engine = self.getOCREngine(key)
+        try:
+            engine.SetPageSegMode(pageSegMode)
+            engine.SetImageBytes(image.tobytes(), width, height, bytesPerPixel, width * bytesPerPixel)
+            return(engine.GetUTF8Text())
+        finally:
+            self.releaseOCREngine(key, engine)
+
+    def getOCRCacheKey(self, image, lang=None, config=None):
+        """Hashes the exact pixels of a crop along with the tesseract arguments which affect its text."""
+        digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=16)
+        digest.update(('%s|%s|%s|%s|%s' % (image.shape, image.dtype, lang, config, self.ocrBackend)).encode())
+        return(digest.hexdigest())
+
+    def getOCRCache(self, key):
+        """Returns the cached text for a key or None, checking memory before ocrCacheDir."""
+        with self.ocrCacheLock:
+            if key in self.ocrCache:
+                self.ocrCache.move_to_end(key)
+                return(self.ocrCache[key])
+
+        if self.ocrCacheDir:
+            path = os.path.join(self.ocrCacheDir, key + '.txt')
+            if os.path.isfile(path):
+                with open(path, 'r') as file:
+                    text = file.read()
+                self.setOCRCache(key, text, persist=False)
+                return(text)
+
+        return(None)
+
+    def setOCRCache(self, key, text, persist=True):
+        """Stores text for a key, evicting the least recently used entries past ocrCacheSize."""
+        if self.ocrCacheSize:
+            with self.ocrCacheLock:
+                self.ocrCache[key] = text
+                self.ocrCache.move_to_end(key)
+                while len(self.ocrCache) > self.ocrCacheSize:
+                    self.ocrCache.popitem(last=False)
+
+        if persist and self.ocrCacheDir:
+            # Written aside and moved into place so readers in other threads or processes never see half a file
+            path      = os.path.join(self.ocrCacheDir, key + '.txt')
+            temporary = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+            try:
+                with open(temporary, 'w') as file:
+                    file.write(text)
+                os.replace(temporary, path)
+            except Exception as e:
+                printer('Failed to persist OCR result: %s' % str(e))
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+
     def getImageLightness(self, image):
         """
         Understanding the values this returns
@@ -119,7 +374,10 @@ class CV():
         than other parts of the UI which do not change size. Just a note.
         """
 
-        result = np.mean(self.convertImage(self.prepImage(image), 'gray'))
+        if isinstance(image, Frame):
+            result = image.getLightness()
+        else:
+            result = np.mean(self.getGray(image))
         if self.debug:
             print(f'Image lightness is {result}')
 
@@ -134,11 +392,12 @@ class CV():
         result = self.getImageLightness(image)
         return(result >= light_threshold)
 
-    def getTextWithCoordinates(self, image, lang=None, mode=None, config=None, morphX=5, morphY=2, binaryMin=100, binaryMax=255, iterations=10):
+    def getTextWithCoordinates(self, image, lang=None, mode=None, config=None, morphX=5, morphY=2, binaryMin=100, binaryMax=255, iterations=10, workers=None):
+        """Finds blocks of text and returns a dict of text: [centerX, centerY]."""
+        """Each block is a tesseract call of its own, workers=N runs up to N of them at once."""
 
         results   = {}
-        image     = self.prepImage(image)
-        imageGray = self.convertImage(image, 'gray')
+        imageGray = self.getGray(image)
 
         # Cover for processing images which are mostly light or mostly dark
         # For the kernel + dilation step
@@ -147,7 +406,10 @@ class CV():
         else:
             mode='binary'
 
-        imageThreshold   = self.convertImage(imageGray, mode=mode, binaryMin=binaryMin, binaryMax=binaryMax)
+        if isinstance(image, Frame):
+            imageThreshold = image.getConverted(mode, binaryMin=binaryMin, binaryMax=binaryMax, gray=True)
+        else:
+            imageThreshold = self.convertImage(imageGray, mode=mode, binaryMin=binaryMin, binaryMax=binaryMax)
         kernel           = cv2.getStructuringElement(cv2.MORPH_RECT, (morphX,morphY))
         dilation         = cv2.dilate(imageThreshold, kernel, iterations=iterations)
 
@@ -158,6 +420,8 @@ class CV():
         # Sort them top to bottom
         contours = self.sortContours(contours)
 
+        boxes   = []
+        targets = []
         for contour in contours:
             perimeter = cv2.arcLength(contour, True)
             approx = cv2.approxPolyDP(contour, 0.02*perimeter, True)
@@ -166,10 +430,18 @@ class CV():
 
             # Slight width boost, tiny boost in height - all sides
             # gray seems to do the best
-            target = imageGray[y-2:y+h+2, x-5:x+w+5]
+            boxes.append((x, y, w, h))
+            targets.append(imageGray[y-2:y+h+2, x-5:x+w+5])
+
+        # Get text in each area, don't pass mode to tesseract.
+        # tesseract runs out of process so threads are enough to overlap the calls.
+        if workers and workers > 1 and len(targets) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                texts = list(executor.map(lambda target: self.getText(target, lang=lang, mode=None, config=config), targets))
+        else:
+            texts = [self.getText(target, lang=lang, mode=None, config=config) for target in targets]
 
-            # Get text in this area, don't pass mode to tesseract.
-            text    = self.getText(target, lang=lang, mode=None, config=config)
+        for (x, y, w, h), target, text in zip(boxes, targets, texts):
 
             # If we find text in a contour, write it to the results with the
             # center x,y coordinate of the contour.
@@ -232,50 +504,126 @@ class CV():
         cv2.waitKey(timeout)
         cv2.destroyAllWindows()
 
-    def searchImageInImage(self, needleImage, haystackImage, threshold=None, mode=None, cropX=None, cropY=None, cropLength=None, cropHeight=None):
-        """Searches for an image inside another image with a strict default threshold."""
-        """Accepts array of x,y,h,w for searching a cropped section of the haystack."""
-        haystackImage_rgb = self.prepImage(haystackImage)
-        needleImage_rgb   = self.prepImage(needleImage)
+    def prepHaystack(self, haystackImage, mode=None, cropX=None, cropY=None, cropLength=None, cropHeight=None):
+        """Decodes, crops and converts a haystack once so it can be searched for many needles."""
+        if not mode:
+            mode = self.defaultMode
 
+        haystack = {'source': haystackImage, 'color': self.prepImage(haystackImage)}
+        cropped  = cropX and cropY and cropLength and cropHeight
+
+        # Crop the search area if requested.
+        if cropped:
+            if self.debug: printer('Haystack is cropped.')
+            haystack['color'] = haystack['color'][cropY:cropY+cropHeight, cropX:cropX+cropLength]
+            #self.showImage(haystack['color'])
+
+        # Whole Frames keep their conversions for the next search this tick
+        frame = haystackImage if isinstance(haystackImage, Frame) and not cropped else None
+
+        if mode in ('grayscale', 'pyramid'):
+            haystack['grayscale'] = frame.getGray() if frame else self.convertImage(haystack['color'], 'gray')
+
+        # Build the downscaled levels once, level 0 being the full resolution gray image.
+        if mode == 'pyramid':
+            if frame:
+                haystack['pyramid'] = frame.getPyramid(self.pyramidLevels)
+            else:
+                haystack['pyramid'] = self.buildPyramid(haystack['grayscale'], self.pyramidLevels)
+
+        return(haystack)
+
+    def loadNeedle(self, needleImage):
+        """Returns the color and gray forms of a needle, decoding file paths only once while their mtime is unchanged."""
+        if not isinstance(needleImage, str) or not self.needleCacheSize or not os.path.isfile(needleImage):
+            return({'color': self.prepImage(needleImage)})
+
+        mtime = os.stat(needleImage).st_mtime_ns
+
+        with self.needleCacheLock:
+            cached = self.needleCache.get(needleImage)
+            if cached and cached['mtime'] == mtime:
+                self.needleCache.move_to_end(needleImage)
+                return(cached)
+
+        needleImage_rgb = self.prepImage(needleImage)
+        needleImage_gray = self.convertImage(needleImage_rgb, 'gray')
+        needle = {'color': needleImage_rgb, 'gray': needleImage_gray, 'mtime': mtime, 'bytes': needleImage_rgb.nbytes + needleImage_gray.nbytes}
+
+        with self.needleCacheLock:
+            if needleImage in self.needleCache:
+                self.needleCacheBytes -= self.needleCache.pop(needleImage)['bytes']
+
+            self.needleCache[needleImage] = needle
+            self.needleCacheBytes += needle['bytes']
+
+            # Evict the least recently used needles until we're back under budget
+            while self.needleCacheBytes > self.needleCacheSize and len(self.needleCache) > 1:
+                _, evicted = self.needleCache.popitem(last=False)
+                self.needleCacheBytes -= evicted['bytes']
+                if self.debug: printer('Evicted a needle from the cache.')
+
+        return(needle)
+
+    def clearNeedleCache(self):
+        """Drops every cached needle."""
+        with self.needleCacheLock:
+            self.needleCache.clear()
+            self.needleCacheBytes = 0
+
+    def matchNeedle(self, needleImage, haystack, threshold=None, mode=None, multiple=False, overlapThreshold=0.3):
+        """Matches one needle against a haystack from prepHaystack returning (x, y, w, h) or False."""
+        """With multiple=True returns every non-overlapping [x, y, w, h] under the threshold instead,
+        by default defaultMultipleThreshold rather than defaultThreshold."""
+        needle          = self.loadNeedle(needleImage)
+        needleImage_rgb = needle['color']
 
         if not threshold:
-            threshold = self.defaultThreshold
+            threshold = self.defaultMultipleThreshold if multiple else self.defaultThreshold
 
         if not mode:
             mode      = self.defaultMode
 
-        if self.debug: printer('Looking for %s' % os.path.basename(needleImage))
+        if self.debug and isinstance(needleImage, str): printer('Looking for %s' % os.path.basename(needleImage))
 
 
         # Get the dimensions of the needle image
         h, w = needleImage_rgb.shape[:2]
 
-
-        # Crop the search area if requested.
-        if cropX and cropY and cropLength and cropHeight:
-            if self.debug: printer('Haystack is cropped.')
-            haystackImage_rgb = haystackImage_rgb[cropY:cropY+cropHeight, cropX:cropX+cropLength]
-            #self.showImage(haystackImage_rgb)
-
         # Match
         try:
             if mode == 'color':
-                results             = cv2.matchTemplate(needleImage_rgb, haystackImage_rgb, cv2.TM_SQDIFF_NORMED)
-            elif mode == 'grayscale':
-                needleImage_gray    = self.convertImage(needleImage_rgb,   'gray')
-                haystackImage_gray  = self.convertImage(haystackImage_rgb, 'gray')
-                results             = cv2.matchTemplate(needleImage_gray, haystackImage_gray, cv2.TM_SQDIFF_NORMED)
+                results             = cv2.matchTemplate(needleImage_rgb, haystack['color'], cv2.TM_SQDIFF_NORMED)
+                minVal, maxVal, minIdx, maxIdx = minMaxLoc = cv2.minMaxLoc(results)
+            elif mode in ('grayscale', 'pyramid'):
+                needleImage_gray    = needle.get('gray')
+                if needleImage_gray is None:
+                    needleImage_gray = self.convertImage(needleImage_rgb, 'gray')
+
+                if mode == 'pyramid' and not multiple:
+                    minVal, minIdx  = self.matchPyramid(needleImage_gray, haystack['pyramid'])
+
+                    # Every coarse candidate can miss a small or low contrast needle, so a miss is
+                    # confirmed at full resolution before it's reported. Misses cost a grayscale match.
+                    if minVal >= float(threshold):
+                        results     = cv2.matchTemplate(needleImage_gray, haystack['grayscale'], cv2.TM_SQDIFF_NORMED)
+                        minVal, _, minIdx, _ = cv2.minMaxLoc(results)
+                else:
+                    results         = cv2.matchTemplate(needleImage_gray, haystack['grayscale'], cv2.TM_SQDIFF_NORMED)
+                    minVal, maxVal, minIdx, maxIdx = minMaxLoc = cv2.minMaxLoc(results)
             else:
                 printer('Unknown mode %s' % mode)
+                return(False)
         except Exception as e:
             print('Failed to compare:')
-            print("\t%s" % haystackImage)
+            print("\t%s" % haystack['source'])
             print("\t%s" % needleImage)
             print(e)
             return(False)
 
-        minVal, maxVal, minIdx, maxIdx = minMaxLoc = cv2.minMaxLoc(results)
+        if multiple:
+            return(self.findAllMatches(results, w, h, threshold, overlapThreshold=overlapThreshold))
+
         MPx, MPy = minIdx
 
         if self.debug:
@@ -297,11 +645,180 @@ class CV():
 
         # Draw for debug
         #if self.debug:
-        #    self.showImage(haystackImage_rgb)
-        #    cv2.rectangle(haystackImage_rgb, (MPx, MPy), (MPx+w, MPy+h), (0, 0, 255) , 2)
+        #    self.showImage(haystack['color'])
+        #    cv2.rectangle(haystack['color'], (MPx, MPy), (MPx+w, MPy+h), (0, 0, 255) , 2)
 
         return(MPx, MPy, w, h)
 
+    def findAllMatches(self, results, w, h, threshold, overlapThreshold=0.3):
+        """Turns a TM_SQDIFF_NORMED result map into every [x, y, w, h] under the threshold with overlapping hits merged."""
+
+        # Only keep local minima so each hit contributes one candidate rather than its whole neighbourhood
+        kernel     = cv2.getStructuringElement(cv2.MORPH_RECT, (max(w//2, 1), max(h//2, 1)))
+        localMin   = cv2.erode(results, kernel)
+        ys, xs     = np.nonzero((results <= localMin) & (results < float(threshold)))
+
+        if not len(xs):
+            if self.debug: printer('\t%%red%%[Failed]%%none%% No scores under %s' % threshold)
+            return(False)
+
+        scores     = results[ys, xs]
+        boxes      = np.stack([xs, ys, np.full_like(xs, w), np.full_like(ys, h)], axis=1)
+        boxes      = boxes[self.nonMaxSuppression(boxes, scores, overlapThreshold=overlapThreshold)]
+
+        if self.debug:
+            printer('\t%%green%%[Match]%%none%% Found %d matches under %s' % (len(boxes), threshold))
+
+        return(boxes.tolist())
+
+    def nonMaxSuppression(self, boxes, scores, overlapThreshold=0.3):
+        """Returns the indexes of the boxes to keep, lowest (best) scores first, dropping any which overlap a kept box by more than overlapThreshold (IoU)."""
+        boxes  = np.asarray(boxes, dtype=np.float64)
+        x1     = boxes[:, 0]
+        y1     = boxes[:, 1]
+        x2     = x1 + boxes[:, 2]
+        y2     = y1 + boxes[:, 3]
+        areas  = boxes[:, 2] * boxes[:, 3]
+        order  = np.argsort(scores, kind='stable')
+        keep   = []
+
+        while order.size:
+            best = order[0]
+            keep.append(best)
+            rest = order[1:]
+
+            # Intersection of the best box against all remaining boxes at once
+            overlapW = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+            overlapH = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+            overlap  = overlapW * overlapH
+            iou      = overlap / (areas[best] + areas[rest] - overlap)
+
+            order = rest[iou <= overlapThreshold]
+
+        return(np.array(keep, dtype=np.intp))
+
+    def buildPyramid(self, image, levels):
+        """Returns [image, image/2, image/4, ...] levels deep."""
+        pyramid = [image]
+        for level in range(levels):
+            pyramid.append(cv2.pyrDown(pyramid[-1]))
+
+        return(pyramid)
+
+    def matchPyramid(self, needleImage_gray, haystackPyramid):
+        """Coarse to fine TM_SQDIFF_NORMED match returning (minVal, (x, y)) at full resolution."""
+        """Candidates are found on the smallest usable pyramid level then refined in small full resolution regions."""
+        h, w = needleImage_gray.shape[:2]
+
+        # Go as deep as the haystack allows while the needle keeps enough detail to match on.
+        needlePyramid = [needleImage_gray]
+        while len(needlePyramid) < len(haystackPyramid):
+            nh, nw = needlePyramid[-1].shape[:2]
+            if nh // 2 < self.pyramidMinSize or nw // 2 < self.pyramidMinSize:
+                break
+            needlePyramid.append(cv2.pyrDown(needlePyramid[-1]))
+
+        level = len(needlePyramid) - 1
+        if level == 0: # Needle is too small to downscale, plain full resolution match.
+            results = cv2.matchTemplate(needleImage_gray, haystackPyramid[0], cv2.TM_SQDIFF_NORMED)
+            minVal, maxVal, minIdx, maxIdx = cv2.minMaxLoc(results)
+            return(minVal, minIdx)
+
+        coarse  = cv2.matchTemplate(needlePyramid[level], haystackPyramid[level], cv2.TM_SQDIFF_NORMED)
+        ch, cw  = needlePyramid[level].shape[:2]
+        scale   = 2 ** level
+        pad     = scale * 2 # Covers the rounding error of each pyrDown
+        best    = (float('inf'), (0, 0))
+
+        for candidate in range(self.pyramidCandidates):
+            coarseVal, _, (cx, cy), _ = cv2.minMaxLoc(coarse)
+            if coarseVal >= 1.0: # Nothing left which isn't already masked out
+                break
+
+            # Mask this candidate's neighbourhood so the next pass finds a different one
+            coarse[max(cy-ch//2, 0):cy+ch//2+1, max(cx-cw//2, 0):cx+cw//2+1] = 1.0
+
+            # Refine in a small full resolution region around the candidate
+            x1 = max(cx * scale - pad, 0)
+            y1 = max(cy * scale - pad, 0)
+            region  = haystackPyramid[0][y1:cy*scale+h+pad, x1:cx*scale+w+pad]
+            if region.shape[0] < h or region.shape[1] < w:
+                continue
+
+            results = cv2.matchTemplate(needleImage_gray, region, cv2.TM_SQDIFF_NORMED)
+            minVal, maxVal, (rx, ry), maxIdx = cv2.minMaxLoc(results)
+            if minVal < best[0]:
+                best = (minVal, (x1 + rx, y1 + ry))
+
+        if self.debug: printer('Pyramid search at level %s, best score %s' % (level, best[0]))
+
+        return(best)
+
+    def searchImageInImage(self, needleImage, haystackImage, threshold=None, mode=None, cropX=None, cropY=None, cropLength=None, cropHeight=None, multiple=False, overlapThreshold=0.3):
+        """Searches for an image inside another image with a strict default threshold."""
+        """Accepts array of x,y,h,w for searching a cropped section of the haystack."""
+        """multiple=True returns a list of every [x, y, w, h] match under the threshold after non-maximum suppression."""
+        """Without a threshold multiple uses the stricter defaultMultipleThreshold."""
+        haystack = self.prepHaystack(haystackImage, mode=mode, cropX=cropX, cropY=cropY, cropLength=cropLength, cropHeight=cropHeight)
+        return(self.matchNeedle(needleImage, haystack, threshold=threshold, mode=mode, multiple=multiple, overlapThreshold=overlapThreshold))
+
+    def searchImagesInImage(self, needleImages, haystackImage, threshold=None, mode=None, cropX=None, cropY=None, cropLength=None, cropHeight=None, threads=None, multiple=False, overlapThreshold=0.3):
+        """Searches for many needles in one haystack which is only decoded and converted once."""
+        """Returns a dict of needle: (x, y, w, h) or False, keyed by position for needles which aren't file paths."""
+        """cv2.matchTemplate releases the GIL so threads=N fans the needles out across a thread pool."""
+        haystack = self.prepHaystack(haystackImage, mode=mode, cropX=cropX, cropY=cropY, cropLength=cropLength, cropHeight=cropHeight)
+        keys     = [needle if isinstance(needle, str) else index for index, needle in enumerate(needleImages)]
+
+        if threads and threads > 1:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                matches = list(executor.map(lambda needle: self.matchNeedle(needle, haystack, threshold=threshold, mode=mode, multiple=multiple, overlapThreshold=overlapThreshold), needleImages))
+        else:
+            matches = [self.matchNeedle(needle, haystack, threshold=threshold, mode=mode, multiple=multiple, overlapThreshold=overlapThreshold) for needle in needleImages]
+
+        return(dict(zip(keys, matches)))
+
+    def trackImageInImage(self, needleImage, haystackImage, threshold=None, mode=None, padding=32, key=None):
+        """Like searchImageInImage but first searches a padded window around where this needle was last found."""
+        """Only falls back to searching the whole haystack on a miss. Needles which aren't file paths need a key to be tracked."""
+        if key is None and isinstance(needleImage, str):
+            key = needleImage
+
+        image = self.prepImage(haystackImage)
+
+        if key is not None and key in self.trackedNeedles:
+            x, y, w, h = self.trackedNeedles[key]
+            x1 = max(x - padding, 0)
+            y1 = max(y - padding, 0)
+            window = image[y1:y+h+padding, x1:x+w+padding]
+
+            haystack = self.prepHaystack(window, mode=mode)
+            match    = self.matchNeedle(needleImage, haystack, threshold=threshold, mode=mode)
+            if match:
+                if self.debug: printer('Found %s near its last location.' % key)
+                match = (match[0] + x1, match[1] + y1, match[2], match[3])
+                self.trackedNeedles[key] = match
+                return(match)
+
+            if self.debug: printer('Lost %s, searching the whole haystack.' % key)
+
+        haystack = self.prepHaystack(image, mode=mode)
+        match    = self.matchNeedle(needleImage, haystack, threshold=threshold, mode=mode)
+
+        if key is not None:
+            if match:
+                self.trackedNeedles[key] = match
+            else:
+                self.trackedNeedles.pop(key, None)
+
+        return(match)
+
+    def forgetTracked(self, key=None):
+        """Forget where a tracked needle was last seen, or every needle without a key."""
+        if key is None:
+            self.trackedNeedles.clear()
+        else:
+            self.trackedNeedles.pop(key, None)
+
     def getCoordinatesFromPercentage(self, x, y, xPercent, yPercent):
         xResult = int(x / 100 * xPercent)
         yResult = int(y / 100 * yPercent)
@@ -317,20 +834,36 @@ class CV():
         """By default looks for 'tall' rectangles."""
         """Could replace processScreenshot's text processing role by matching against white rectangles here instead."""
         """Can convert input R,G,B values to H,S,V"""
+        """minColor and maxColor may also be lists of colors to search several ranges against one HSV conversion,"""
+        """returning a list with the result of each range in the same order."""
 
-        image = self.prepImage(image)
-        image_hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        if mode not in ('tall', 'wide'):
+            printer('Unsupported mode.')
+            return(False)
+
+        image_hsv = self.getHSV(image)
+
+        if np.ndim(minColor) == 2:
+            return([self.findBoxOfColorFillingHSV(image_hsv, minHeight, minWidth, rangeMin, rangeMax, maxHeight=maxHeight, maxWidth=maxWidth, mode=mode, multiple=multiple, convertToHSV=convertToHSV, morphX=morphX, morphY=morphY) for rangeMin, rangeMax in zip(minColor, maxColor)])
+
+        return(self.findBoxOfColorFillingHSV(image_hsv, minHeight, minWidth, minColor, maxColor, maxHeight=maxHeight, maxWidth=maxWidth, mode=mode, multiple=multiple, convertToHSV=convertToHSV, morphX=morphX, morphY=morphY))
+
+    def findBoxOfColorFillingHSV(self, image_hsv, minHeight, minWidth, minColor, maxColor, maxHeight=None, maxWidth=None, mode='tall', multiple=False, convertToHSV=False, morphX=None, morphY=None):
+        """findBoxOfColorFilling for one color range of an image already converted to HSV."""
 
         if convertToHSV:
-            print('Ranges converted to HSV:')
-            print('\t' , minColor, maxColor)
+            if self.debug:
+                print('Ranges converted to HSV:')
+                print('\t' , minColor, maxColor)
             minColor = np.array(self.rgb_to_hsv(minColor), np.uint8)
             maxColor = np.array(self.rgb_to_hsv(maxColor), np.uint8)
-            print('After:')
-            print('\t' , minColor, maxColor)
+            if self.debug:
+                print('After:')
+                print('\t' , minColor, maxColor)
         else:
-            print('Ranges kept as is:')
-            print('\t' , minColor, maxColor)
+            if self.debug:
+                print('Ranges kept as is:')
+                print('\t' , minColor, maxColor)
             minColor = np.array(minColor)
             maxColor = np.array(maxColor)
 
@@ -345,85 +878,54 @@ class CV():
             colorMask = cv2.morphologyEx(colorMask, cv2.MORPH_DILATE, kernel)
             #self.showImage(colorMask, timeout=1000)
 
-        contours, _ = cv2.findContours(colorMask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        print('contours: %s' % str(len(contours)))
+        # One x, y, w, h, area row per filled region, top to bottom. Row 0 is the background.
+        count, _, stats, _ = cv2.connectedComponentsWithStats(colorMask, connectivity=8)
+        boxes = stats[1:, :4]
+        if self.debug: print('components: %s' % str(len(boxes)))
 
-        #if self.debug:
-            #cv2.drawContours(image, contours, -1, (0, 255, 0), 2) # Debug draw
-            #self.showImage(image, timeout=2000)
+        # Filter every box at once rather than one contour at a time
+        w, h = boxes[:, 2], boxes[:, 3]
 
+        if mode == 'tall':
+            keep = w <= h
+        else: # wide
+            keep = h <= w
 
-        if multiple:
-            resultArray = []
+        keep &= (w >= minWidth) & (h >= minHeight)
 
-        if contours:
-            seenRectangles = [] # Avoid scanning the same match twice.
+        if maxHeight and maxWidth:
+            keep &= (h <= maxHeight) & (w <= maxWidth)
 
-            for contour in contours:
-                perimeter = cv2.arcLength(contour, True)
-                approx = cv2.approxPolyDP(contour, 0.02*perimeter, True)
-                x, y, w, h = cv2.boundingRect(approx)
+        boxes = boxes[keep]
 
-                #if self.debug:
-                #    print('Processing contour: %s' % str([x, y, w, h]))
+        # Avoid returning the same rectangle twice, keeping the top to bottom order.
+        _, firstSeen = np.unique(boxes, axis=0, return_index=True)
+        boxes = boxes[np.sort(firstSeen)]
 
-                match mode:
-                    case 'tall':
-                        if w > h: # If not tall
-                            continue
-
-                    case 'wide':
-                        if h > w: # If not wide
-                            continue
-
-                    case _:
-                        printer('Unsupported mode.')
-                        return(False)
-
-
-
-                if [x, y, w, h] in seenRectangles:
-                    #if self.debug: print('Rectangle already seen.')
-                    continue
-
-                if w < minWidth or h < minHeight:
-                    #if self.debug: print('Min height or width not met.')
-                    continue
-
-                if maxHeight and maxWidth:
-                    if h > maxHeight or w > maxWidth:
-                        #if self.debug: print('Max height or width exceeded.')
-                        continue
-
-                if self.debug:
-                    print("Height=%s, Width=%s" % (h, w))
-                    print('Processing contour: %s' % str([x, y, w, h]))
-                    #cv2.rectangle(image, (x, y), (x+w, y+h), (0, 0, 255) , 2); self.showImage(image, timeout=1000)
-
-                seenRectangles.append([x, y, w, h])
-
-                if multiple:
-                    resultArray.append([x, y, w, h])
-
-                else:
-                    if self.debug: printer('Found a contour with filling')
-                    return(x, y, w, h)
+        if not len(boxes):
+            if self.debug:
+                print('Found no boxes of color filling.')
+            return(False)
 
-            if not multiple:
-                return(False)
+        if self.debug:
+            for bx, by, bw, bh in boxes:
+                print("Height=%s, Width=%s" % (bh, bw))
+                print('Processing contour: %s' % str([bx, by, bw, bh]))
 
-            if self.debug:
-                printer('Found %d contours with filling' % len(resultArray))
+        if not multiple:
+            if self.debug: printer('Found a contour with filling')
+            return(tuple(int(value) for value in boxes[0]))
 
-            return(resultArray)
+        if self.debug:
+            printer('Found %d contours with filling' % len(boxes))
 
-        else:
-            if debug:
-                print('Found no boxes of color filling.')
-            return(False)
+        return(boxes.tolist())
 
     def convertImage(self, image, mode, binaryMin=200, binaryMax=255):
         """A wrapper to quickly convert image data. On attempt failure returns the original image"""
+        if isinstance(image, Frame):
+            return(image.getConverted(mode, binaryMin=binaryMin, binaryMax=binaryMax))
+
         try:
             match mode:
                 case 'gray':
@@ -452,3 +954,49 @@ class CV():
             case _:
                 printer('Not sure how to sort contours with a keyword like: %s' % mode)
                 return(False)
+
+class Frame():
+    def __init__(self, image, cv=None, shape=None):
+        """
+        One screenshot whose derived representations (decoded BGR, gray, HSV, thresholds,
+        lightness, pyramids) are computed on first use and then remembered. Pass it to any
+        CV method in place of the image so calls in the same tick stop redoing conversions.
+        The image must not be modified while the Frame is in use. shape is passed on to prepImage.
+        """
+        self.cv     = cv or CV()
+        self.source = image
+        self.shape  = shape
+        self.cache  = {}
+        self.lock   = threading.RLock()
+
+    def memoize(self, key, compute):
+        """Returns cache[key], running compute() to fill it the first time."""
+        if key not in self.cache:
+            with self.lock:
+                if key not in self.cache:
+                    self.cache[key] = compute()
+
+        return(self.cache[key])
+
+    def getImage(self):
+        return(self.memoize('image', lambda: self.cv.prepImage(self.source, shape=self.shape)))
+
+    def getGray(self):
+        return(self.memoize('gray', lambda: self.cv.getGray(self.getImage())))
+
+    def getHSV(self):
+        return(self.memoize('hsv', lambda: cv2.cvtColor(self.getImage(), cv2.COLOR_BGR2HSV)))
+
+    def getLightness(self):
+        return(self.memoize('lightness', lambda: np.mean(self.getGray())))
+
+    def getPyramid(self, levels):
+        return(self.memoize(('pyramid', levels), lambda: self.cv.buildPyramid(self.getGray(), levels)))
+
+    def getConverted(self, mode, binaryMin=200, binaryMax=255, gray=False):
+        """convertImage of the frame, or of its gray version with gray=True, remembered by arguments."""
+        if mode == 'gray':
+            return(self.getGray())
+
+        source = self.getGray if gray else self.getImage
+        return(self.memoize(('converted', mode, binaryMin, binaryMax, gray), lambda: self.cv.convertImage(source(), mode, binaryMin=binaryMin, binaryMax=binaryMax)))
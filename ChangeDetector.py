@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+from jModules.Colors     import colors,printer
+from jModules.CV         import CV
+
+import cv2
+import numpy as np
+
+#Usage:
+# Sits between Screenshooter and CV so unchanged frames can be skipped.
+#   from jModules.ChangeDetector import ChangeDetector
+#   detector = ChangeDetector()
+#   changed, rects = detector.check(screenshooter.get(return_result=True))
+#   if changed:
+#       for x, y, w, h in rects: ...
+
+class ChangeDetector():
+    def __init__(self, cv=None, scale=8, threshold=12, debug=False):
+        """
+        Keeps a downsampled grayscale fingerprint of the last frame and reports what changed since.
+        cv,         A CV object to decode frames with, by default a new one.
+        scale,      How many pixels wide and tall each fingerprint cell covers.
+        threshold,  How far (0-255) a cell's average brightness must move to count as changed.
+        """
+        self.debug       = debug
+        self.cv          = cv or CV(debug=debug)
+        self.scale       = scale
+        self.threshold   = threshold
+        self.fingerprint = None
+        self.frameSize   = None
+
+    def getFingerprint(self, image):
+        """Shrinks a frame to one averaged gray value per scale x scale cell."""
+        gray = self.cv.convertImage(image, 'gray') if image.ndim == 3 else image
+        height, width = gray.shape[:2]
+        return(cv2.resize(gray, (max(width // self.scale, 1), max(height // self.scale, 1)), interpolation=cv2.INTER_AREA))
+
+    def check(self, image):
+        """
+        Returns (changed, rects) for a frame compared to the previous one checked.
+        rects are [x, y, w, h] in frame coordinates covering every changed area,
+        the whole frame the first time around or when the frame size changes.
+        """
+        image       = self.cv.prepImage(image)
+        height, width = image.shape[:2]
+        fingerprint = self.getFingerprint(image)
+        previous    = self.fingerprint
+
+        self.fingerprint = fingerprint
+
+        if previous is None or self.frameSize != (width, height):
+            self.frameSize = (width, height)
+            return(True, [[0, 0, width, height]])
+
+        # Cells which moved past the threshold, grown by a cell so neighbours merge into one rect
+        dirty = cv2.absdiff(fingerprint, previous)
+        _, dirty = cv2.threshold(dirty, self.threshold, 255, cv2.THRESH_BINARY)
+
+        if not cv2.countNonZero(dirty):
+            return(False, [])
+
+        dirty = cv2.dilate(dirty, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(dirty, connectivity=8)
+
+        # Label 0 is the unchanged background. Scale the cells back up and clip them to the frame.
+        stats = stats[1:, :4].astype(np.int64)
+        xScale = width  / fingerprint.shape[1]
+        yScale = height / fingerprint.shape[0]
+        x1 = np.floor(stats[:, 0] * xScale).astype(np.int64)
+        y1 = np.floor(stats[:, 1] * yScale).astype(np.int64)
+        x2 = np.minimum(np.ceil((stats[:, 0] + stats[:, 2]) * xScale).astype(np.int64), width)
+        y2 = np.minimum(np.ceil((stats[:, 1] + stats[:, 3]) * yScale).astype(np.int64), height)
+        rects = np.stack([x1, y1, x2 - x1, y2 - y1], axis=1).tolist()
+
+        if self.debug:
+            printer('%d changed regions: %s' % (len(rects), rects))
+
+        return(True, rects)
+
+    def reset(self):
+        """Forget the last frame so the next one is reported as changed in full."""
+        self.fingerprint = None
+        self.frameSize   = None
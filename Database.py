@@ -1,19 +1,95 @@
 #!/usr/bin/env python
+from contextlib import contextmanager
 import hashlib
+import itertools
 import json
 import re
 import time
 import datetime
 import os
+import queue
+import threading
+import weakref
 from dateutil import parser
 
 #Usage:
 # Refer to Database.schema.json for an example schema to pass in.
 #   from jModules.Database import Database
 #   database = Database(databaseFile=dbFile, schema=schemaFile)
+#
+# Group writes into one commit:
+#   with database.transaction():
+#     database.query(...)
+#     database.query(...)
+#
+# Share one Database between threads with a pool, each thread gets a connection and cursor of its own:
+#   database = Database(databaseFile=dbFile, schema=schemaFile, poolSize=8)
+#   with database.connection(): # Optional, hands the connection back as soon as the block ends
+#     database.query(...)
+
+# Applied to every sqlite connection unless overridden by the schema's "sqlitePragmas" or the pragmas argument.
+# WAL lets readers carry on while one writer commits, and NORMAL synchronous is durable in WAL mode short of power loss.
+sqlitePragmas = {
+  'journal_mode': 'WAL',
+  'synchronous':  'NORMAL',
+  'cache_size':   -65536,     # KiB when negative, so 64MiB
+  'mmap_size':    268435456,  # 256MiB
+  'temp_store':   'MEMORY',
+  'busy_timeout': 5000,       # Milliseconds to wait on a lock before failing
+}
+
+def leased(name):
+  """A Database attribute which lives on the DatabaseConnection in use, so each pooled thread has its own."""
+  return(property(lambda self: getattr(self.getConnection(), name),
+                  lambda self, value: setattr(self.getConnection(), name, value)))
+
+class DatabaseConnection:
+  """One connection, its cursor and the commit bookkeeping that goes with them."""
+  def __init__(self, con):
+    self.transactionDepth = 0
+    self.lock             = threading.RLock() # Held around statements and commits so the 'time' flusher can't cut in
+    self.open(con)
+
+  def open(self, con):
+    self.con           = con
+    self.cur           = con.cursor()
+    self.pendingWrites = 0
+    self.lastCommit    = time.time()
+    self.lastUsed      = time.time()
+
+class DatabaseLease:
+  """A thread's hold on a pooled connection, handed back to the pool when the thread ends."""
+  def __init__(self, database, connection):
+    self.connection = connection
+    self.finalizer  = weakref.finalize(self, database.checkin, connection)
 
 class Database: # Our database object
-  def __init__(self, schema=None, databaseFile=None, backend='sqlite', host='localhost', username='', password='', debug=False):
+
+  # The connection in use, shared or the calling thread's own when pooled
+  con              = leased('con')
+  cur              = leased('cur')
+  pendingWrites    = leased('pendingWrites')
+  lastCommit       = leased('lastCommit')
+  transactionDepth = leased('transactionDepth')
+
+  def __init__(self, schema=None, databaseFile=None, backend='sqlite', host='localhost', username='', password='', debug=False, commitPolicy='statement', commitEvery=100, commitInterval=1000, pragmas=None, poolSize=0, poolTimeout=30):
+    """
+    poolSize,       Open up to this many connections and give each thread one of its own, checked out on
+                    its first query and returned by release(), the end of a connection() block or the
+                    thread ending. 0 shares a single connection like before. With more threads than
+                    poolSize wrap each unit of work in connection() so connections go round.
+    poolTimeout,    Seconds a thread waits for a free connection once poolSize are checked out.
+    pragmas,        sqlite pragma: value pairs layered over the module's sqlitePragmas and the schema's
+                    "sqlitePragmas" key, or False to connect with sqlite's own defaults.
+    commitPolicy,   When exec() commits outside of a transaction():
+                      'statement'  After every statement (the default).
+                      'count'      Every commitEvery statements.
+                      'time'       Once writes have waited commitInterval milliseconds, from a background
+                                   thread so an idle connection doesn't sit on sqlite's write lock.
+                      'manual'     Only on commit() or at the end of a transaction().
+                    With anything but 'statement' call commit() before exiting so the last writes aren't lost.
+                    When pooled the policy and transaction() apply to each thread's connection separately.
+    """
 
     self.backend          = backend
     self.databaseBasename = databaseFile.split('.')[0]
@@ -27,6 +103,36 @@ class Database: # Our database object
     self.tables           = []
     self.table            = None
 
+    # Generated SQL text for query() keyed by the shape of the call, values are bound separately.
+    self.queryCache       = {}
+
+    if commitPolicy not in ('statement', 'count', 'time', 'manual'):
+      print(f'[{__name__}] Unknown commitPolicy: {commitPolicy}')
+      exit(1)
+
+    self.commitPolicy     = commitPolicy
+    self.commitEvery      = commitEvery
+    self.commitInterval   = commitInterval
+    self.connections      = weakref.WeakSet() # Every open DatabaseConnection, for the 'time' flusher
+    self.flushing         = False
+
+    self.shared           = None
+    self.poolSize         = poolSize
+    self.poolTimeout      = poolTimeout
+    self.poolPingAfter    = 30 # Seconds a pooled connection can sit idle before it's checked on checkout
+    if self.poolSize:
+      self.pool           = queue.LifoQueue() # Idle connections, most recently used first
+      self.poolLock       = threading.Lock()
+      self.poolOpen       = 0
+      self.local          = threading.local()
+
+    if pragmas is False:
+      self.pragmas        = {}
+      self.pragmasGiven   = {}
+    else:
+      self.pragmasGiven   = pragmas or {}
+      self.pragmas        = {**sqlitePragmas, **self.pragmasGiven}
+
     try: # Configure for the appropriate backend
       if self.debug:
           print(f'[{__name__}] Using database backend %s' % self.backend)
@@ -34,24 +140,23 @@ class Database: # Our database object
       match self.backend:
         case 'sqlite':
           import sqlite3
+          self.driver = sqlite3
           self.mode = 'sqlite3'
           if not databaseFile.endswith('.sqlite') and not databaseFile.endswith('.db'):
             self.databaseFile = databaseFile + '.db'
 
-          self.con = sqlite3.connect(self.databaseFile,check_same_thread=False)
-          self.cur = self.con.cursor()
+          self.placeholder = '?'
 
         case 'mysql':
           import MySQLdb
+          self.driver = MySQLdb
           self.mode = 'mysql'
           if not self.username:
               self.username = self.databaseBasename
 
-          self.con = MySQLdb.connect(host=self.host,
-                                     user=self.username,
-                                     password=self.password,
-                                     database=self.databaseBasename,connect_timeout=5)
-          self.cur = self.con.cursor()
+          self.placeholder = '%s'
+
+      self.getConnection() # Connect now so a bad configuration fails here
 
     except Exception as e:
       print(f"[{__name__}] Failed to establish backend %s: %s" % (self.backend,e))
@@ -85,6 +190,16 @@ class Database: # Our database object
             print(f"[{__name__}] See 'Database.schema.json' for an example.")
             exit(1)
 
+        # Not a table. Pragmas given to the constructor win over the schema's.
+        if 'sqlitePragmas' in self.schema:
+          self.schema     = dict(self.schema)
+          schemaPragmas   = self.schema.pop('sqlitePragmas') or {}
+          if pragmas is not False:
+            schemaPragmas = {key: value for key, value in schemaPragmas.items() if key not in self.pragmasGiven}
+            self.pragmas.update(schemaPragmas)
+            if self.mode == 'sqlite3':
+              self.applyPragmas(schemaPragmas)
+
         # Determine how many tables we're working with
         for key in self.schema.keys():
           self.tables.append(key)
@@ -134,32 +249,315 @@ class Database: # Our database object
 
             self.exec(tableQuery)
 
+          self.commit()
+
         except Exception as e:
           print(f'[{__name__}] Failed to prepare Database: ', e)
           exit(1)
 
-  def exec(self, query):
+    if self.commitPolicy == 'time':
+      self.flushing = True
+      threading.Thread(target=self.flushWorker, daemon=True).start()
+
+    # The constructor's thread doesn't keep a pooled connection to itself
+    self.release()
+
+  def connect(self):
+    """Opens a new connection to the backend."""
+    match self.mode:
+      case 'sqlite3':
+        con = self.driver.connect(self.databaseFile,check_same_thread=False)
+        self.applyPragmas(self.pragmas, con=con)
+
+      case 'mysql':
+        con = self.driver.connect(host=self.host,
+                                  user=self.username,
+                                  password=self.password,
+                                  database=self.databaseBasename,connect_timeout=5)
+
+    if self.debug: print(f'[{__name__}] Opened a new %s connection' % self.backend)
+    return(con)
+
+  def newConnection(self):
+    """Connects and wraps the connection in a DatabaseConnection which the 'time' flusher can see."""
+    connection = DatabaseConnection(self.connect())
+    self.connections.add(connection)
+    return(connection)
+
+  def getConnection(self):
+    """The DatabaseConnection in use, checking one out of the pool for this thread when pooled."""
+    if not self.poolSize:
+      if self.shared is None:
+        self.shared = self.newConnection()
+      return(self.shared)
+
+    lease = getattr(self.local, 'lease', None)
+    if lease is None:
+      lease = self.local.lease = DatabaseLease(self, self.checkout())
+
+    return(lease.connection)
+
+  def checkout(self):
+    """Takes an idle connection from the pool, opening another while under poolSize or else waiting up to poolTimeout."""
+    try:
+      return(self.checkHealth(self.pool.get_nowait()))
+    except queue.Empty:
+      pass
+
+    with self.poolLock:
+      opening = self.poolOpen < self.poolSize
+      if opening:
+        self.poolOpen += 1
+
+    if opening:
+      try:
+        return(self.newConnection())
+      except Exception:
+        with self.poolLock:
+          self.poolOpen -= 1
+        raise
+
+    try:
+      return(self.checkHealth(self.pool.get(timeout=self.poolTimeout)))
+    except queue.Empty:
+      raise TimeoutError(f'[{__name__}] No connection free after {self.poolTimeout}s, all {self.poolSize} are checked out')
+
+  def checkin(self, connection):
+    """Puts a connection back in the pool, committing whatever it had pending. Threads should use release()."""
+    try:
+      with connection.lock:
+        if connection.pendingWrites:
+          connection.con.commit()
+    except Exception as e:
+      print(f'[{__name__}] Dropping a pooled connection which failed to commit: {e}')
+      self.discard(connection)
+      return
+
+    connection.pendingWrites = 0
+    connection.lastUsed      = time.time()
+    self.pool.put(connection)
+
+  def checkHealth(self, connection):
+    """Checks a connection which sat idle in the pool for a while, replacing it if it went away."""
+    if time.time() - connection.lastUsed < self.poolPingAfter:
+      return(connection)
+
+    try:
+      match self.mode:
+        case 'sqlite3':
+          connection.con.execute('select 1')
+        case 'mysql':
+          connection.con.ping()
+    except Exception as e:
+      if self.debug: print(f'[{__name__}] Pooled connection failed its health check: {e}')
+      self.reconnect(connection)
+
+    return(connection)
+
+  def reconnect(self, connection=None):
+    """Swaps a connection, by default the one in use, for a fresh one. Anything uncommitted on it is lost."""
+    connection = connection or self.getConnection()
+    try:
+      connection.con.close()
+    except Exception:
+      pass
+
+    connection.open(self.connect())
+
+  def discard(self, connection):
+    """Closes a pooled connection for good, freeing its place in the pool."""
+    self.connections.discard(connection)
+    try:
+      connection.con.close()
+    except Exception:
+      pass
+
+    with self.poolLock:
+      self.poolOpen -= 1
+
+  def isDisconnect(self, error):
+    """True for MySQL's server has gone away (2006) and lost connection (2013, 2055) errors."""
+    return(self.mode == 'mysql' and isinstance(error, self.driver.OperationalError) and error.args[:1] in ((2006,), (2013,), (2055,)))
+
+  def release(self):
+    """Hands this thread's pooled connection back, committing anything pending. Does nothing without a pool."""
+    lease = getattr(self.local, 'lease', None) if self.poolSize else None
+    if lease is None:
+      return
+
+    if lease.connection.transactionDepth:
+      print(f'[{__name__}] Not releasing a connection in the middle of a transaction()')
+      return
+
+    del self.local.lease
+    lease.finalizer()
+
+  @contextmanager
+  def connection(self):
+    """Holds a pooled connection for the with block and releases it after, unless the thread already held one."""
+    held = self.poolSize and getattr(self.local, 'lease', None) is not None
+    try:
+      yield(self)
+    finally:
+      if not held:
+        self.release()
+
+  def close(self):
+    """Commits and closes every connection not checked out, or the shared one."""
+    self.flushing = False
+
+    if not self.poolSize:
+      if self.shared:
+        self.commit()
+        self.connections.discard(self.shared)
+        self.shared.con.close()
+        self.shared = None
+      return
+
+    self.release()
+    while True:
+      try:
+        self.discard(self.pool.get_nowait())
+      except queue.Empty:
+        break
+
+  def exec(self, query, params=None):
+    """Runs a query. With params the query uses placeholders and the values are bound, not interpolated."""
     if self.debug:
         t1 = time.time()
 
-    query = query.replace("'None'",'NULL')
-    self.cur.execute(query)
-    self.con.commit()
+    if params is None:
+      query = query.replace("'None'",'NULL')
+
+    with self.getConnection().lock:
+      for attempt in (1, 2):
+        try:
+          if params is None:
+            self.cur.execute(query)
+          else:
+            self.cur.execute(query, params)
+          break
+
+        except Exception as e:
+          # MySQL drops connections left idle past its wait_timeout. Go again on a fresh one,
+          # but only if that can't lose earlier writes which were never committed.
+          if attempt == 2 or not self.isDisconnect(e) or self.transactionDepth or self.pendingWrites:
+            raise
+          if self.debug: print(f'[{__name__}] Reconnecting after: {e}')
+          self.reconnect()
+
+      self.afterStatement()
 
     if self.debug:
         t2 = time.time()
         print(f'[{__name__}] Query took: {t2 - t1}')
 
-  def execFetchAll(self, query):
-    self.exec(query)
+  def applyPragmas(self, pragmas, con=None):
+    """Sets sqlite pragmas on a connection, by default ours."""
+    con = con or self.con
+    for key, value in pragmas.items():
+      # Pragmas can't take bound parameters, only allow plain names and values through.
+      if not re.fullmatch(r'\w+', str(key)) or not re.fullmatch(r'-?\w+', str(value)):
+        print(f'[{__name__}] Ignoring invalid pragma {key} = {value}')
+        continue
+
+      result = con.execute(f'pragma {key} = {value}').fetchall()
+      if self.debug:
+          print(f'[{__name__}] pragma {key} = {value} {result}')
+
+  def afterStatement(self):
+    """Commits according to commitPolicy, never inside a transaction()."""
+    # Reads come back with a result set and leave nothing to commit
+    if self.cur.description is None:
+      self.pendingWrites += 1
+
+    if self.transactionDepth:
+      return
+
+    match self.commitPolicy:
+      case 'statement':
+        # Nothing to commit after a plain read
+        if self.mode == 'sqlite3' and not self.con.in_transaction:
+          self.pendingWrites = 0
+          return
+        self.commit()
+
+      case 'count':
+        if self.pendingWrites >= self.commitEvery:
+          self.commit()
+
+      case 'time':
+        if self.pendingWrites and (time.time() - self.lastCommit) * 1000 >= self.commitInterval:
+          self.commit()
+
+  def commit(self):
+    """Commits anything pending."""
+    with self.getConnection().lock:
+      self.con.commit()
+      self.pendingWrites = 0
+      self.lastCommit    = time.time()
+
+  def rollback(self):
+    """Throws away anything not yet committed."""
+    with self.getConnection().lock:
+      self.con.rollback()
+      self.pendingWrites = 0
+
+  def flush(self):
+    """Commits every connection whose writes have waited commitInterval, skipping busy ones and open transactions."""
+    for connection in list(self.connections):
+      if not connection.lock.acquire(blocking=False):
+        continue
+
+      try:
+        if connection.pendingWrites and not connection.transactionDepth and (time.time() - connection.lastCommit) * 1000 >= self.commitInterval:
+          connection.con.commit()
+          connection.pendingWrites = 0
+          connection.lastCommit    = time.time()
+      except Exception as e:
+        print(f'[{__name__}] Timed commit failed: {e}')
+      finally:
+        connection.lock.release()
+
+  def flushWorker(self):
+    """Runs flush() every commitInterval for the 'time' commitPolicy until close()."""
+    while self.flushing:
+      time.sleep(self.commitInterval / 1000)
+      self.flush()
+
+  @contextmanager
+  def transaction(self):
+    """
+    Groups every statement inside the with block into one commit, rolling it all back if the block raises.
+    Nested transactions join the outermost one. Writes still pending from before are committed first
+    so a rollback only ever undoes the block.
+    """
+    if not self.transactionDepth and self.pendingWrites:
+      self.commit()
+
+    self.transactionDepth += 1
+    try:
+      yield(self)
+    except BaseException:
+      self.transactionDepth -= 1
+      if not self.transactionDepth:
+        self.rollback()
+      raise
+    else:
+      self.transactionDepth -= 1
+      if not self.transactionDepth:
+        self.commit()
+
+  def execFetchAll(self, query, params=None):
+    self.exec(query, params)
     return(self.cur.fetchall())
 
-  def execFetchone(self,query):
-    self.exec(query)
+  def execFetchone(self,query, params=None):
+    self.exec(query, params)
     return(self.cur.fetchone())
 
-  def execFetchAllDict(self, query, showEmpty=False):
-    self.exec(query)
+  def execFetchAllDict(self, query, showEmpty=False, params=None):
+    self.exec(query, params)
     rows = self.cur.fetchall()
     results = []
 
@@ -173,8 +571,8 @@ class Database: # Our database object
 
     return(results)
 
-  def execFetchoneDict(self,query, showEmpty=False):
-    self.exec(query)
+  def execFetchoneDict(self,query, showEmpty=False, params=None):
+    self.exec(query, params)
     row = self.cur.fetchone()
 
     if row == None:
@@ -188,58 +586,38 @@ class Database: # Our database object
     return(dict(zip([c[0] for c in self.cur.description], row)))
 
 
-  def query(self, columns, values, mode=None, order_by_column=None, order_by_desc=False, table=None, where=None, Dict=False, fetch_all=False, limit=None):
-    # If no table given and we're only working with a single table, assume that one
-    if not table and self.table:
-      table = self.table
-    elif not table:
-      print(f'[{__name__}] Cannot guess table for insert, please provide a table argument.')
-      return False
+  def prepValue(self, value):
+    """Values are bound as they are where the driver understands them, anything else as its string like before."""
+    # Stay compatible with rows written when values were quoted into the SQL:
+    # 'None' was stored as NULL and booleans as the text 'True' and 'False'.
+    if isinstance(value, str) and value == 'None':
+      return(None)
 
-    if mode == None:
-        if self.mode == 'sqlite3':
-            mode = 'insert or ignore into'
-        else:
-            mode = 'insert ignore into'
+    if isinstance(value, bool):
+      return(str(value))
 
-    query = "%s %s" % (mode, table)
+    if value is None or isinstance(value, (str, int, float, bytes)):
+      return(value)
 
+    return(str(value))
 
+  def buildQuery(self, mode, table, columns, whereShape=(), order_by_column=None, order_by_desc=False, limit=None):
+    """Builds placeholder SQL for query(). whereShape is a tuple of (column, operator) pairs."""
+    query = "%s %s" % (mode, table)
 
     if 'insert' in mode:
         query += " (%s)" % ', '.join(columns)
-        preppedValues = []
-
-        # Escape values, run through escape_string
-        for value in values:
-            if hasattr(self.con, 'escape_string'):
-                value = f"'{self.con.escape_string(value).decode("utf-8")}'"
-            else:
-                value = "'%s'" % value
-
-            preppedValues.append(value)
-
-        query += " values (%s)" % ', '.join(preppedValues)
+        query += " values (%s)" % ', '.join([self.placeholder] * len(columns))
 
     elif 'update' in mode:
         query += " set "
-        preparedSets = []
-        for i in range(0, len(columns)):
-            column  = columns[i]
-            value   = values[i]
-            if hasattr(self.con, 'escape_string'):
-                value = f"'{self.con.escape_string(value).decode("utf-8")}'"
-            else:
-                value = "'%s'" % value
-            preparedSets.append("%s = %s" % (columns[i], value))
-
-        query += ', '.join(preparedSets)
+        query += ', '.join("%s = %s" % (column, self.placeholder) for column in columns)
 
 
-    if where: # Accept multiple where (x == y) tuples in a list.
+    if whereShape: # Accept multiple where (x == y) tuples in a list.
         wheres = []
-        for clause in where:
-            wheres.append("%s %s '%s'" % (clause[0], clause[1], clause[2]))
+        for column, operator in whereShape:
+            wheres.append("%s %s %s" % (column, operator, self.placeholder))
 
         query += ' where ' + ' and '.join(wheres)
 
@@ -252,25 +630,153 @@ class Database: # Our database object
     if limit and type(limit) == int:
         query += f" limit {limit}"
 
+    return(query)
+
+  def buildBulkQuery(self, table, columns, upsert=False, mode=None):
+    """Builds the placeholder insert for bulkQuery(), optionally upserting the table's updateIfNull columns."""
+    fillColumns = [column for column in self.schema.get(table, {}).get('updateIfNull', []) if column in columns] if upsert and self.schema else []
+
+    if not mode:
+      if fillColumns:
+        mode = 'insert into'
+      elif self.mode == 'sqlite3':
+        mode = 'insert or ignore into'
+      else:
+        mode = 'insert ignore into'
+
+    query = self.buildQuery(mode, table, columns)
+
+    # Existing rows only have their null updateIfNull columns filled in, nothing is overwritten.
+    if fillColumns:
+      if self.mode == 'sqlite3':
+        query += " on conflict do update set " + ', '.join("%s = coalesce(%s.%s, excluded.%s)" % (column, table, column, column) for column in fillColumns)
+      else:
+        query += " on duplicate key update " + ', '.join("%s = coalesce(%s, values(%s))" % (column, column, column) for column in fillColumns)
+
+    return(query)
+
+  def bulkQuery(self, rows, columns=None, table=None, batchSize=1000, upsert=False, mode=None):
+    """
+    Inserts an iterable of rows with executemany in batches of batchSize as one transaction().
+    rows,     Dicts of column: value, or sequences in the order of columns.
+    columns,  Defaults to the keys of the first row when rows are dicts, otherwise to the
+              table's schema columns in order.
+    upsert,   On a conflict fill in the table's schema 'updateIfNull' columns where they're still null
+              (needs SQLite 3.35+), otherwise conflicting rows are ignored like query() inserts.
+    Returns the number of rows sent, or False if the load failed and its transaction was rolled back.
+    Inside an outer transaction() a failure is raised instead, so the outer block rolls back as well.
+    """
+    if not table and self.table:
+      table = self.table
+    elif not table:
+      print(f'[{__name__}] Cannot guess table for insert, please provide a table argument.')
+      return False
+
+    rows  = iter(rows)
+    first = next(rows, None)
+    if first is None:
+      return(0)
+
+    rows = itertools.chain([first], rows)
+
+    if isinstance(first, dict):
+      if not columns:
+        columns = list(first.keys())
+      rows = (tuple(self.prepValue(row.get(column)) for column in columns) for row in rows)
+    else:
+      if not columns and self.schema and table in self.schema:
+        columns = list(self.schema[table]['columns'].keys())
+      elif not columns:
+        print(f'[{__name__}] Cannot guess columns for {table}, please provide a columns argument.')
+        return False
+      rows = (tuple(self.prepValue(value) for value in row) for row in rows)
+
+    key   = ('bulk', mode, table, tuple(columns), upsert)
+    query = self.queryCache.get(key)
+    if query is None:
+      query = self.buildBulkQuery(table, columns, upsert=upsert, mode=mode)
+      self.queryCache[key] = query
+
     if self.debug:
-        print(f'[{__name__}] Raw query:')
+        print(f'[{__name__}] Bulk query:')
         print(f'[{__name__}] {query}')
+        t1 = time.time()
+
+    count  = 0
+    nested = self.transactionDepth
+    try:
+      with self.transaction():
+        while True:
+          batch = list(itertools.islice(rows, batchSize))
+          if not batch:
+            break
+
+          self.cur.executemany(query, batch)
+          count += len(batch)
+
+    except Exception as e:
+      # Only a load which owns its transaction has been rolled back, otherwise leave it to the outer one
+      if nested:
+        raise
+      print(f'[{__name__}] Bulk load into {table} failed: {e}')
+      return(False)
+
+    if self.debug:
+        print(f'[{__name__}] Bulk load of {count} rows took: {time.time() - t1}')
+
+    return(count)
+
+  def query(self, columns, values, mode=None, order_by_column=None, order_by_desc=False, table=None, where=None, Dict=False, fetch_all=False, limit=None):
+    # If no table given and we're only working with a single table, assume that one
+    if not table and self.table:
+      table = self.table
+    elif not table:
+      print(f'[{__name__}] Cannot guess table for insert, please provide a table argument.')
+      return False
+
+    if mode == None:
+        if self.mode == 'sqlite3':
+            mode = 'insert or ignore into'
+        else:
+            mode = 'insert ignore into'
+
+    # Values are always bound, so the SQL only depends on the shape of the call and can be reused.
+    whereShape = tuple((clause[0], clause[1]) for clause in where) if where else ()
+    key        = (mode, table, tuple(columns) if ('insert' in mode or 'update' in mode) else (), whereShape, order_by_column, order_by_desc, limit)
+    query      = self.queryCache.get(key)
+
+    if query is None:
+      query = self.buildQuery(mode, table, columns, whereShape, order_by_column, order_by_desc, limit)
+      self.queryCache[key] = query
+
+    params = []
+    if 'insert' in mode or 'update' in mode:
+      params.extend(self.prepValue(value) for value in values)
+
+    if where:
+      params.extend(self.prepValue(clause[2]) for clause in where)
+
+    params = tuple(params)
+
+    if self.debug:
+        print(f'[{__name__}] Raw query:')
+        print(f'[{__name__}] {query} {params}')
 
     # Run queries below this line
     if 'select' in mode:
         if fetch_all:
             if Dict:
-                result = self.execFetchAllDict(query)
+                result = self.execFetchAllDict(query, params=params)
             else:
-                result = self.execFetchAll(query)
+                result = self.execFetchAll(query, params=params)
         else:
             if Dict:
-                result = self.execFetchoneDict(query)
+                result = self.execFetchoneDict(query, params=params)
             else:
-                result = self.execFetchone(query)
+                result = self.execFetchone(query, params=params)
 
     else:
-        result = self.exec(query)
+        result = self.exec(query, params)
 
     return(result)
 
@@ -1,57 +1,385 @@
-from time import time
+from collections import deque
+from time import time, sleep
+import os
+import queue
 import subprocess
 import sys
+import threading
 
 class Screenshooter():
 
-    def __init__(self,windowId ,debug=False, loglevel=0):
+    def __init__(self,windowId ,debug=False, loglevel=0, backend='import', targetInfo=None, saveQueueSize=64, saveEvery=1, saveFormat='png', saveRetention=None):
+        """
+        targetInfo          Optional XWindow.targetInfo of the window, used to check capture regions fit.
+                            Pass a callable returning it to follow a window whose targetInfo is replaced
+                            as it moves, like XWindow's xlib backend does.
+        backend='import'    Runs ImageMagick's import per frame, screenshots are PNG bytes.
+        backend='xlib'      Reads the window straight out of the X server with python-xlib,
+                            screenshots are BGR np.ndarrays ready for CV without any encoding.
+
+        Debug mode records frames through queueSave() on a background writer:
+        saveQueueSize       Frames allowed to wait for the writer, further frames are dropped rather than stalling capture.
+        saveEvery           Only record every Nth frame.
+        saveFormat          'png' (lossless) or 'npy' (raw arrays, fastest to write and replay).
+        saveRetention       Keep at most this many recorded files, deleting the oldest. None keeps everything.
+        """
         self.screenshot = None
         self.debug      = debug
         self.loglevel   = loglevel
         self.windowId   = windowId
+        self.backend    = backend
+        self.targetInfo = targetInfo
+        self.grabber    = None
+        self.streaming  = False
+        self.frameCount = 0
+        self.ringLock   = threading.Condition()
+
+        self.saveQueue      = queue.Queue(maxsize=saveQueueSize)
+        self.saveEvery      = saveEvery
+        self.saveFormat     = saveFormat
+        self.saveRetention  = saveRetention
+        self.saveCount      = 0
+        self.savedPaths     = deque()
+        self.saveWriter     = None
+
+        if not isinstance(saveEvery, int) or saveEvery < 1:
+            print('saveEvery must be a whole number of frames, 1 or more: %s' % saveEvery, file=sys.stderr)
+            exit(1)
 
         if self.debug:
             self.loglevel=7
 
-    def getNextScreenshotPath(self, return_result=False):
+        match self.backend:
+            case 'import':
+                pass
+
+            case 'xlib':
+                try:
+                    import numpy as np
+                    from Xlib import display, X
+                    self.np      = np
+                    self.X       = X
+                    self.display = display.Display()
+                    self.window  = self.display.create_resource_object('window', int(self.windowId, 16))
+                except Exception as e:
+                    print('Failed to open window %s with python-xlib: %s' % (self.windowId, e), file=sys.stderr)
+                    exit(1)
+
+            case _:
+                print('Unknown screenshot backend: %s' % self.backend, file=sys.stderr)
+                exit(1)
+
+    def getNextScreenshotPath(self, return_result=False, extension='png'):
         """For saving screenshots for debugging and further development without having to run the software or have a certain game state"""
         self.nowUnix        = time()
         self.outputDir      = 'tmp'
-        self.outputFilename = 'screenshot.' + str(self.nowUnix) + '.png'
+        self.outputFilename = 'screenshot.' + str(self.nowUnix) + '.' + extension
         self.screenshotPath = '%s/%s' % (self.outputDir,self.outputFilename)
         if return_result:
             return(self.screenshotPath)
 
-    def get(self, return_result=False):
+    def get(self, return_result=False, region=None):
+        """Takes a screenshot of the window, or only of region=(x, y, width, height) in window coordinates."""
         #print('Taking screenshot') # Debug
-        p = subprocess.Popen(['import', '-window', self.windowId,'PNG:-'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if region:
+            region = self.validateRegion(region)
+            if not region:
+                return(False)
+
+        frame    = self.capture(region=region)
+        captured = time()
+        if frame is not None:
+            self.screenshot = frame
+
+        if self.debug:
+            self.queueSave(timestamp=captured)
+
+        if return_result:
+            return(self.screenshot)
+
+    def getRegions(self, regions):
+        """Captures several (x, y, width, height) regions of the window, returning a list of frames in the same order."""
+        frames = []
+        for region in regions:
+            region = self.validateRegion(region)
+            frames.append(self.capture(region=region) if region else None)
+
+        return(frames)
+
+    def getBounds(self):
+        """Returns the window's (width, height) from targetInfo or the X server, or None when unknown."""
+        targetInfo = self.targetInfo() if callable(self.targetInfo) else self.targetInfo
+        if targetInfo and 'Width' in targetInfo and 'Height' in targetInfo:
+            return(int(targetInfo['Width']), int(targetInfo['Height']))
+
+        if self.backend == 'xlib':
+            geometry = self.window.get_geometry()
+            return(geometry.width, geometry.height)
+
+        return(None)
+
+    def validateRegion(self, region):
+        """Clips an (x, y, width, height) region to the window. Returns False if nothing of it is inside the window."""
+        x, y, width, height = [int(value) for value in region]
+        x2 = x + width
+        y2 = y + height
+        x  = max(x, 0)
+        y  = max(y, 0)
+
+        bounds = self.getBounds()
+        if bounds:
+            x2 = min(x2, bounds[0])
+            y2 = min(y2, bounds[1])
+
+        if x2 <= x or y2 <= y:
+            print('Region %s is outside of window %s %s' % (list(region), self.windowId, bounds), file=sys.stderr)
+            return(False)
+
+        return(x, y, x2 - x, y2 - y)
+
+    def capture(self, out=None, region=None, window=None):
+        """Takes one frame with the configured backend. Returns it, or None on failure."""
+        """xlib frames are written into out when given a BGR array of the right shape."""
+        """region=(x, y, width, height) only fetches those pixels, it is not validated here."""
+        """window is an xlib window on another thread's own display, by default ours."""
+        if self.backend == 'xlib':
+            return(self.captureXlib(out=out, region=region, window=window))
+
+        return(self.captureImport(region=region))
+
+    def captureImport(self, region=None):
+        """PNG bytes of the window from ImageMagick's import."""
+        command = ['import', '-window', self.windowId]
+        if region:
+            command += ['-crop', '%dx%d+%d+%d' % (region[2], region[3], region[0], region[1]), '+repage']
+
+        p = subprocess.Popen(command + ['PNG:-'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         try:
             self.stdout, self.stderr = p.communicate(timeout=5)
         except subprocess.TimeoutExpired:
             p.kill()
-            self.stdout, self.stderr = proc.communicate()
+            self.stdout, self.stderr = p.communicate()
 
-        if self.stdout:
-            self.screenshot = self.stdout
+        return(self.stdout or None)
 
-        if self.debug:
-            self.save()
+    def captureXlib(self, out=None, region=None, window=None):
+        """Copies the window's pixels out of the X server into a BGR array, no PNG round trip."""
+        window = window or self.window
+        try:
+            if region:
+                x, y, width, height = region
+            else:
+                geometry = window.get_geometry()
+                x, y, width, height = 0, 0, geometry.width, geometry.height
 
-        if return_result:
-            return(self.screenshot)
+            image    = window.get_image(x, y, width, height, self.X.ZPixmap, 0xffffffff)
+
+            # ZPixmap at depth 24/32 comes back as BGRX, drop the padding byte.
+            frame = self.np.frombuffer(image.data, dtype=self.np.uint8).reshape(height, width, 4)[:, :, :3]
+
+            if out is not None and out.shape == frame.shape:
+                self.np.copyto(out, frame)
+                return(out)
+
+            return(self.np.ascontiguousarray(frame))
+
+        except Exception as e:
+            print('Failed to capture window %s: %s' % (self.windowId, e), file=sys.stderr)
+            return(None)
+
+    def start(self, bufferSize=8, interval=0, region=None):
+        """
+        Starts capturing continuously on a background thread into a ring of bufferSize frames.
+        interval,   Minimum seconds between captures, 0 captures as fast as the backend allows.
+        region,     Only stream this (x, y, width, height) of the window.
+        Read frames with latest() or frames(). A frame's array is reused once the ring wraps
+        around to it, so copy anything which needs to outlive bufferSize - 1 newer frames.
+        """
+        if self.grabber:
+            return(False)
+
+        if region:
+            region = self.validateRegion(region)
+            if not region:
+                return(False)
+
+        self.ring       = [None] * bufferSize
+        self.ringTimes  = [None] * bufferSize
+        self.frameCount = 0
+        self.ringLock   = threading.Condition()
+        self.streaming  = True
+        self.grabber    = threading.Thread(target=self.grab, args=(interval, region), daemon=True)
+        self.grabber.start()
+        return(True)
+
+    def stop(self):
+        """Stops the background capture thread."""
+        if not self.grabber:
+            return
+
+        with self.ringLock:
+            self.streaming = False
+            self.ringLock.notify_all()
+
+        self.grabber.join()
+        self.grabber = None
+
+    def grab(self, interval, region=None):
+        """The capture loop run by start()."""
+        failures = 0
+        window   = None
+
+        # Xlib connections aren't thread safe and self.display stays with the caller's get() and getBounds()
+        if self.backend == 'xlib':
+            from Xlib import display
+            grabDisplay = display.Display()
+            window      = grabDisplay.create_resource_object('window', int(self.windowId, 16))
+
+        while self.streaming:
+            started = time()
+            slot    = self.frameCount % len(self.ring)
+
+            # Capture straight into the array this slot held last time around the ring
+            frame   = self.capture(out=self.ring[slot], region=region, window=window)
+
+            if frame is not None:
+                captured = time()
+                with self.ringLock:
+                    self.ring[slot]      = frame
+                    self.ringTimes[slot] = captured
+                    self.frameCount     += 1
+                    self.screenshot      = frame
+                    self.ringLock.notify_all()
+                failures = 0
+
+                if self.debug:
+                    self.queueSave(frame, timestamp=captured)
+            else:
+                failures += 1
+
+            if failures:
+                # Back off from 20ms up to a second while captures fail, the window may be minimised or gone
+                sleep(min(0.01 * 2 ** min(failures, 7), 1))
+            elif interval:
+                sleep(max(interval - (time() - started), 0))
+
+        if window:
+            grabDisplay.close()
+
+    def latest(self):
+        """Returns (timestamp, frame) of the newest streamed frame, or (None, None) before the first."""
+        with self.ringLock:
+            if not self.frameCount:
+                return(None, None)
+
+            slot = (self.frameCount - 1) % len(self.ring)
+            return(self.ringTimes[slot], self.ring[slot])
+
+    def frames(self, timeout=None):
+        """
+        Yields (timestamp, frame) for every streamed frame in order until stop() is called,
+        or until no new frame arrives for timeout seconds.
+        A consumer which falls a whole ring behind skips ahead to the oldest frame still held.
+        """
+        seen = self.frameCount
+        while True:
+            with self.ringLock:
+                self.ringLock.wait_for(lambda: self.frameCount > seen or not self.streaming, timeout=timeout)
+                if self.frameCount <= seen:
+                    return
+
+                seen = max(seen, self.frameCount - len(self.ring) + 1)
+                slot = seen % len(self.ring)
+                item = (self.ringTimes[slot], self.ring[slot])
+                seen += 1
+
+            yield(item)
 
     def save(self, Path=None):
         if not Path:
             self.getNextScreenshotPath()
             path = self.screenshotPath
 
-        if self.screenshot and self.screenshotPath:
+        if self.screenshot is not None and self.screenshotPath:
+            return(self.writeScreenshot(self.screenshot, self.screenshotPath))
+
+    def writeScreenshot(self, screenshot, path, saveFormat='png'):
+        """Writes PNG bytes as they are, or an array as PNG or raw npy."""
+        try:
+            if saveFormat == 'npy' and not isinstance(screenshot, bytes):
+                import numpy as np
+                with open(path, "wb") as outputFile:
+                    np.save(outputFile, screenshot)
+            else:
+                if not isinstance(screenshot, bytes): # Raw frames from the xlib backend
+                    import cv2
+                    screenshot = cv2.imencode('.png', screenshot)[1].tobytes()
+
+                with open(path, "wb") as outputFile:
+                    outputFile.write(screenshot)
+
+            if self.loglevel >= 7: print('Saved: %s' % path, file=sys.stderr)
+
+            return(True)
+
+        except Exception as e:
+            print('Failed to save %s' % path)
+
+    def queueSave(self, screenshot=None, timestamp=None):
+        """
+        Hands a frame (by default the last screenshot) to the background writer without blocking.
+        timestamp is when it was captured, by default now, and names the file so replays keep their timing.
+        Returns False when the frame was skipped by saveEvery or dropped because the queue is full.
+        """
+        if screenshot is None:
+            screenshot = self.screenshot
+
+        if screenshot is None:
+            return(False)
+
+        self.saveCount += 1
+        if self.saveCount % self.saveEvery:
+            return(False)
+
+        # Streamed arrays get overwritten once the ring wraps around, so take our own copy.
+        if self.grabber and not isinstance(screenshot, bytes):
+            screenshot = screenshot.copy()
+
+        if not self.saveWriter:
+            self.saveWriter = threading.Thread(target=self.saveWorker, daemon=True)
+            self.saveWriter.start()
+
+        try:
+            self.saveQueue.put_nowait((timestamp or time(), screenshot))
+        except queue.Full:
+            if self.loglevel >= 7: print('Save queue full, dropped a frame', file=sys.stderr)
+            return(False)
+
+        return(True)
+
+    def saveWorker(self):
+        """Drains saveQueue to disk and applies saveRetention."""
+        while True:
+            timestamp, screenshot = self.saveQueue.get()
             try:
-                with open(self.screenshotPath, "wb") as outputFile:
-                    outputFile.write(self.screenshot)
-                if self.loglevel >= 7: print('Saved: %s' % self.screenshotPath, file=sys.stderr)
+                if isinstance(screenshot, bytes) or self.saveFormat != 'npy':
+                    extension = 'png'
+                else:
+                    extension = 'npy'
+
+                # Not getNextScreenshotPath(), its attributes belong to save() on the capture thread
+                path = 'tmp/screenshot.%s.%s' % (timestamp, extension)
+                if self.writeScreenshot(screenshot, path, saveFormat=self.saveFormat):
+                    self.savedPaths.append(path)
 
-                return(True)
+                while self.saveRetention and len(self.savedPaths) > self.saveRetention:
+                    try:
+                        os.remove(self.savedPaths.popleft())
+                    except OSError:
+                        pass
+            finally:
+                self.saveQueue.task_done()
 
-            except Exception as e:
-                print('Failed to save %s' % self.screenshotPath)
+    def flushSaves(self):
+        """Blocks until every queued frame has been written."""
+        self.saveQueue.join()
@@ -1,12 +1,76 @@
 import os
 import re
+import threading
+
+def findWindows(pattern, root=None):
+    """
+    Returns every window line matching pattern, each starting with the 0xWindowID.
+    With a python-xlib root window the tree is walked directly into '0xid "name" ("instance" "class")'
+    lines, otherwise the lines come from xwininfo -tree -root.
+    """
+    if root is None:
+        all_windows   = os.popen('xwininfo -tree -root').read()
+        return(re.findall(f'^.*{pattern}.*$', all_windows, re.MULTILINE))
+
+    matches = []
+    windows = [root]
+
+    while windows:
+        window = windows.pop()
+        try:
+            windows.extend(window.query_tree().children)
+            name     = window.get_wm_name() or ''
+            wmClass  = window.get_wm_class() or ()
+        except Exception: # Windows can disappear while we're walking the tree
+            continue
+
+        if not name and not wmClass:
+            continue
+
+        line = '%s "%s" (%s)' % (hex(window.id), name, ' '.join('"%s"' % part for part in wmClass))
+        if re.search(pattern, line):
+            matches.append(line)
+
+    return(matches)
 
 class XWindow():
 
-    def __init__(self,target,debug=False):
+    def __init__(self,target,debug=False,backend='xwininfo',windowId=None):
+        """
+        backend='xwininfo'  Finds the window and its geometry by parsing xwininfo output.
+        backend='xlib'      Asks the X server directly through python-xlib without spawning anything,
+                            then keeps targetInfo's geometry current from ConfigureNotify events.
+        windowId            Use this 0xWindowID rather than searching for target, for windows already found.
+        """
         self.debug      = debug
+        self.backend    = backend
         self.targetInfo = {}
-        self.setTarget(target)
+        self.watcher    = None
+
+        match self.backend:
+            case 'xwininfo':
+                pass
+
+            case 'xlib':
+                try:
+                    from Xlib import display, X
+                    self.X       = X
+                    self.display = display.Display()
+                    self.root    = self.display.screen().root
+                except Exception as e:
+                    print(f'Failed to connect to the X server with python-xlib: {e}')
+                    exit(1)
+
+            case _:
+                print(f'Unknown XWindow backend: {self.backend}')
+                exit(1)
+
+        if windowId:
+            self.target         = target
+            self.targetWindowId = windowId
+            self.getTargetProperties()
+        else:
+            self.setTarget(target)
 
     def setTarget(self, target):
         """Set a new target"""
@@ -15,8 +79,7 @@ class XWindow():
 
     def getTarget(self):
         """Get the window id of the desired target"""
-        all_windows   = os.popen('xwininfo -tree -root').read()
-        matches       = re.findall(f'^.*{self.target}.*$', all_windows, re.MULTILINE)
+        matches = findWindows(self.target, root=self.root if self.backend == 'xlib' else None)
 
         if len(matches) == 0:
             print(f'No matches for a window text "{self.target}".')
@@ -43,11 +106,28 @@ class XWindow():
             print('[getTargetProperties] Need target first!')
             return(False)
 
-        self.targetInfo['id']          = self.targetWindowId
+        if self.backend == 'xlib':
+            self.targetInfo = self.getTargetPropertiesXlib(self.display, self.targetWindowId)
+            self.watch()
+        else:
+            self.targetInfo = self.getTargetPropertiesXwininfo()
+
+        self.targetInfo['dimensions']  = re.findall(r'\d+',self.targetWindowId[5])
+        self.targetInfo['Center']      = [int(self.targetInfo['Width']) / 2, int(self.targetInfo['Height']) / 2]
+
+        if self.debug:
+            print('Got K,V\'s:')
+            from pprint import pprint
+            pprint(self.targetInfo, sort_dicts=False)
+
+    def getTargetPropertiesXwininfo(self):
+        """Parse xwininfo -id output into key,values"""
+        targetInfo = {}
+        targetInfo['id']          = self.targetWindowId
 
         # Use the ID to re-fetch cleaner info
 
-        window_info = os.popen(f'xwininfo -id {self.targetInfo['id']}').read()
+        window_info = os.popen(f'xwininfo -id {self.targetWindowId}').read()
 
 
         for line in window_info.split('\n'):
@@ -63,16 +143,178 @@ class XWindow():
             value      = delimiter.join(line_split[1:]).strip()
             if key == '' or value == '':
                 continue
-            self.targetInfo[key]=value
+            targetInfo[key]=value
 
-        if 'Corners' in self.targetInfo:
-            self.targetInfo['Corners'] = self.targetInfo['Corners'].strip().split('  ')
+        if 'Corners' in targetInfo:
+            targetInfo['Corners'] = targetInfo['Corners'].strip().split('  ')
 
-        self.targetInfo['dimensions']  = re.findall(r'\d+',self.targetWindowId[5])
-        self.targetInfo['Center']      = [int(self.targetInfo['Width']) / 2, int(self.targetInfo['Height']) / 2]
+        return(targetInfo)
 
-        if self.debug:
-            print('Got K,V\'s:')
-            from pprint import pprint
-            pprint(self.targetInfo, sort_dicts=False)
+    def getTargetPropertiesXlib(self, display, windowId):
+        """The xwininfo keys we rely on, straight from the X server."""
+        window   = display.create_resource_object('window', int(windowId, 16))
+        geometry = window.get_geometry()
+        absolute = window.translate_coords(display.screen().root, 0, 0)
+
+        # translate_coords gives the root's position relative to the window, flip it around.
+        x = -absolute.x
+        y = -absolute.y
+
+        return({
+            'id':                       windowId,
+            'Absolute upper-left X':    str(x),
+            'Absolute upper-left Y':    str(y),
+            'Relative upper-left X':    str(geometry.x),
+            'Relative upper-left Y':    str(geometry.y),
+            'Width':                    str(geometry.width),
+            'Height':                   str(geometry.height),
+            'Depth':                    str(geometry.depth),
+            'Border width':             str(geometry.border_width),
+        })
+
+    def watch(self):
+        """Starts a thread which refreshes targetInfo whenever the window is moved or resized."""
+        # A watcher for a previous target exits on its next event
+        if self.watcher and self.watcher.is_alive() and self.watcher.name == self.targetWindowId:
+            return
+
+        self.watcher = threading.Thread(target=self.watchEvents, args=(self.targetWindowId,), name=self.targetWindowId, daemon=True)
+        self.watcher.start()
+
+    def watchEvents(self, windowId):
+        """Blocks on ConfigureNotify events for a window on a connection of its own, Xlib connections aren't thread safe."""
+        from Xlib import display
+        watchDisplay = display.Display()
+        window       = watchDisplay.create_resource_object('window', int(windowId, 16))
+        window.change_attributes(event_mask=self.X.StructureNotifyMask)
+
+        while windowId == self.targetWindowId:
+            event = watchDisplay.next_event()
+
+            if windowId != self.targetWindowId: # Target changed while we waited
+                break
+
+            if event.type == self.X.DestroyNotify:
+                if self.debug: print(f'Window {windowId} was destroyed')
+                break
+
+            if event.type == self.X.ConfigureNotify:
+                try:
+                    targetInfo = self.getTargetPropertiesXlib(watchDisplay, windowId)
+                except Exception:
+                    break
+
+                targetInfo['dimensions'] = self.targetInfo.get('dimensions')
+                targetInfo['Center']     = [int(targetInfo['Width']) / 2, int(targetInfo['Height']) / 2]
+                self.targetInfo          = targetInfo # Swapped whole so readers never see it half updated
+
+                if self.debug: print(f'Window {windowId} is now {targetInfo["Width"]}x{targetInfo["Height"]}')
+
+        watchDisplay.close()
+
+class XWindows():
+
+    def __init__(self, pattern, debug=False, backend='xwininfo'):
+        """
+        Tracks every window matching pattern as a set of XWindow objects keyed by 0xWindowID.
+        Call refresh() to pick up windows which opened or closed. With backend='xlib' each
+        window's geometry stays current on its own, see XWindow.
+        """
+        self.debug     = debug
+        self.backend   = backend
+        self.pattern   = pattern
+        self.windows   = {}
+        self.pipelines = {}
+        self.pipeline  = None
+        self.root      = None
+
+        if self.backend == 'xlib':
+            try:
+                from Xlib import display
+                self.display = display.Display()
+                self.root    = self.display.screen().root
+            except Exception as e:
+                print(f'Failed to connect to the X server with python-xlib: {e}')
+                exit(1)
+
+        self.refresh()
+
+    def refresh(self):
+        """
+        Re-scans for matching windows, adding new ones, dropping closed ones and re-reading the geometry
+        of the rest unless xlib already keeps it current. Returns the window dict.
+        """
+        found = {}
+        for line in findWindows(self.pattern, root=self.root):
+            windowId = line.split()[0] # Take the 0xWindowID only
+            found[windowId] = line
+
+        for windowId in list(self.windows):
+            if windowId not in found:
+                if self.debug: print(f'Window {windowId} is gone')
+                del self.windows[windowId]
+
+        for windowId in found:
+            new = windowId not in self.windows
+            try:
+                if new:
+                    if self.debug: print(f'Found window {windowId}: {found[windowId]}')
+                    self.windows[windowId] = XWindow(self.pattern, debug=self.debug, backend=self.backend, windowId=windowId)
+                elif self.backend != 'xlib':
+                    # xlib windows keep their own geometry current, the rest are re-read every refresh
+                    self.windows[windowId].getTargetProperties()
+            except Exception as e:
+                # Closed since findWindows() listed it
+                if self.debug: print(f'Window {windowId} went away: {e}')
+                self.windows.pop(windowId, None)
+                continue
+
+            # Windows opened after run() get a pipeline of their own
+            if new and self.pipeline:
+                self.startPipeline(windowId)
+
+        return(self.windows)
+
+    def ids(self):
+        """The 0xWindowIDs currently tracked."""
+        return(list(self.windows))
+
+    def geometry(self):
+        """0xWindowID: targetInfo of every tracked window."""
+        return({windowId: window.targetInfo for windowId, window in self.windows.items()})
+
+    def run(self, pipeline, screenshooterArgs=None, cvArgs=None):
+        """
+        Runs pipeline(window, screenshooter, cv) on a thread per window, each with a Screenshooter
+        and CV of its own so the windows are processed in parallel within this one process.
+        The pipeline should return once its window is closed. Returns the threads by 0xWindowID.
+        """
+        self.pipeline          = pipeline
+        self.screenshooterArgs = screenshooterArgs or {}
+        self.cvArgs            = cvArgs or {}
+
+        for windowId in self.windows:
+            self.startPipeline(windowId)
+
+        return(self.pipelines)
+
+    def startPipeline(self, windowId):
+        """Starts the run() pipeline for one window unless it's already running."""
+        from jModules.CV            import CV
+        from jModules.Screenshooter import Screenshooter
+
+        if windowId in self.pipelines and self.pipelines[windowId].is_alive():
+            return
+
+        window        = self.windows[windowId]
+        # Looked up on every use, the xlib watcher swaps in a new targetInfo when the window changes
+        screenshooter = Screenshooter(windowId, targetInfo=lambda: window.targetInfo, **self.screenshooterArgs)
+        cv            = CV(**self.cvArgs)
+
+        self.pipelines[windowId] = threading.Thread(target=self.pipeline, args=(window, screenshooter, cv), name=windowId, daemon=True)
+        self.pipelines[windowId].start()
 
+    def join(self):
+        """Waits for every pipeline to finish."""
+        for thread in list(self.pipelines.values()):
+            thread.join()